@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+#
+# Sorted multiset kept as a list of sorted array blocks.
+#
+# main1.py keeps one flat sorted list and pays an O(n) memmove for
+# every list.insert/list.remove.  Here the values live in blocks of
+# between load/2 and 2*load values, each an array, so an insert or
+# remove only moves the tail of one block.  maxes[i] is the last value
+# of block i and locates the block of a value by bisect; a Fenwick tree
+# over the block lengths turns positions into (block, offset) pairs in
+# O(log(n/load)).  Below 2*load values there is a single block and an
+# op is just a bisect plus array.insert, as in main1.py.
+#
+# Like the center of the RB drivers, a cursor is kept on the lower
+# median and stepped by at most one position per add or remove, so
+# reading the median is O(1).  It is only located again through the
+# Fenwick tree when blocks are split or merged.
+#
+# usage: python BlockList.py    runs the tests
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+LOAD = 1000
+
+
+class BlockList(object):
+
+    def __init__(self, items=(), load=LOAD, typecode='l'):
+        self.load = load
+        self.typecode = typecode
+        self.size = 0
+        items = sorted(items)
+        self.blocks = [array(typecode, items[i:i + load])
+                       for i in xrange(0, len(items), load)]
+        if len(self.blocks) > 1 and len(self.blocks[-1]) < load // 2:
+            # a short last block goes into the one before it
+            self.blocks[-2].extend(self.blocks.pop())
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(items)
+        self.rebuild()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for block in self.blocks:
+            for e in block:
+                yield e
+
+    def __contains__(self, e):
+        i = bisect_left(self.maxes, e)
+        if i == len(self.maxes):
+            return False
+        block = self.blocks[i]
+        return block[bisect_left(block, e)] == e
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("BlockList index out of range")
+        i, j = self.locate(index)
+        return self.blocks[i][j]
+
+    def rebuild(self):
+        """rebuild the Fenwick tree after blocks were split or merged,
+           and place the cursor on the lower median again"""
+        n = len(self.blocks)
+        tree = [0] * (n + 1)
+        for i, block in enumerate(self.blocks):
+            i += 1
+            tree[i] += len(block)
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.top = 1
+        while self.top * 2 <= n:
+            self.top *= 2
+        if self.size:
+            self.cb, self.co = self.locate((self.size - 1) // 2)
+        else:
+            self.cb = self.co = 0
+
+    def grow(self, i, delta):
+        """block i got delta values more"""
+        tree = self.tree
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def before(self, i):
+        """number of values in the blocks before block i"""
+        tree = self.tree
+        result = 0
+        while i:
+            result += tree[i]
+            i -= i & -i
+        return result
+
+    def locate(self, index):
+        """return (block, offset) of the value at position index"""
+        tree = self.tree
+        n = len(tree) - 1
+        pos = 0
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= index:
+                pos = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return pos, index
+
+    def stepForward(self):
+        self.co += 1
+        if self.co >= len(self.blocks[self.cb]) and \
+           self.cb + 1 < len(self.blocks):
+            self.cb += 1
+            self.co = 0
+
+    def stepBackward(self):
+        if self.co:
+            self.co -= 1
+        else:
+            self.cb -= 1
+            self.co = len(self.blocks[self.cb]) - 1
+
+    def insert(self, e):
+        blocks, maxes = self.blocks, self.maxes
+        if not blocks:
+            blocks.append(array(self.typecode, [e]))
+            maxes.append(e)
+            self.size = 1
+            self.rebuild()
+            return
+
+        i = bisect_left(maxes, e)
+        if i == len(maxes):
+            i -= 1
+        block = blocks[i]
+        j = bisect_right(block, e)
+        block.insert(j, e)
+        if j + 1 == len(block):
+            maxes[i] = e
+        self.size += 1
+
+        if len(block) > 2 * self.load:
+            half = len(block) // 2
+            blocks[i:i + 1] = [block[:half], block[half:]]
+            maxes[i:i + 1] = [block[half - 1], block[-1]]
+            self.rebuild()
+            return
+        self.grow(i, 1)
+
+        # the cursor value moves one up if e went in before it; the
+        # lower median moves one up when the size becomes odd
+        shifted = i < self.cb or (i == self.cb and j <= self.co)
+        if shifted and i == self.cb:
+            self.co += 1
+        if shifted and not self.size % 2:
+            self.stepBackward()
+        elif not shifted and self.size % 2:
+            self.stepForward()
+
+    def add(self, e):
+        self.insert(e)
+
+    def remove(self, e):
+        """remove one copy of e, ValueError if there is none"""
+        blocks, maxes = self.blocks, self.maxes
+        i = bisect_left(maxes, e)
+        if i == len(maxes):
+            raise ValueError("BlockList.remove: value not in list")
+        block = blocks[i]
+        j = bisect_left(block, e)
+        if block[j] != e:
+            raise ValueError("BlockList.remove: value not in list")
+        del block[j]
+        self.size -= 1
+
+        if len(block) < self.load // 2 and len(blocks) > 1 or not block:
+            # merge with a neighbour, splitting again if that got too big
+            if not block:
+                del blocks[i], maxes[i]
+            else:
+                if i == len(blocks) - 1:
+                    i -= 1
+                block = blocks[i] + blocks[i + 1]
+                if len(block) > 2 * self.load:
+                    half = len(block) // 2
+                    blocks[i:i + 2] = [block[:half], block[half:]]
+                    maxes[i:i + 2] = [block[half - 1], block[-1]]
+                else:
+                    blocks[i:i + 2] = [block]
+                    maxes[i:i + 2] = [block[-1]]
+            self.rebuild()
+            return
+        maxes[i] = block[-1]
+        self.grow(i, -1)
+
+        # removing the cursor value leaves the cursor on the next one
+        if i < self.cb or (i == self.cb and j < self.co):
+            if i == self.cb:
+                self.co -= 1
+            if self.size % 2:
+                self.stepForward()
+        else:
+            if self.co == len(blocks[self.cb]) and self.cb + 1 < len(blocks):
+                self.cb += 1
+                self.co = 0
+            if not self.size % 2:
+                self.stepBackward()
+
+    def count(self, e):
+        return self.rank(e, bisect_right) - self.rank(e)
+
+    def rank(self, e, bisect=bisect_left):
+        """number of values less than e (less or equal with
+           bisect_right)"""
+        i = bisect(self.maxes, e)
+        if i == len(self.maxes):
+            return self.size
+        return self.before(i) + bisect(self.blocks[i], e)
+
+    def index(self, e):
+        if e not in self:
+            raise ValueError("BlockList.index: value not in list")
+        return self.rank(e)
+
+    def median(self):
+        if not self.size:
+            raise ValueError
+        block = self.blocks[self.cb]
+        low = block[self.co]
+        if self.size % 2:
+            return low
+        if self.co + 1 < len(block):
+            return (low + block[self.co + 1]) / 2.0
+        return (low + self.blocks[self.cb + 1][0]) / 2.0
+
+
+def checkBlocks(blocks):
+    """assert the block sizes, maxes, Fenwick tree and median cursor"""
+    lengths = [len(block) for block in blocks.blocks]
+    assert sum(lengths) == blocks.size
+    if len(lengths) > 1:
+        for n in lengths:
+            assert blocks.load // 2 <= n <= 2 * blocks.load
+    assert blocks.maxes == [block[-1] for block in blocks.blocks]
+    for i in xrange(len(lengths)):
+        assert blocks.before(i) == sum(lengths[:i])
+        assert list(blocks.blocks[i]) == sorted(blocks.blocks[i])
+    if blocks.size:
+        assert blocks.before(blocks.cb) + blocks.co == (blocks.size - 1) // 2
+
+
+def testBlockList():
+    import random
+    print "--- Testing BlockList ---"
+
+    def compare(blocks, values):
+        checkBlocks(blocks)
+        assert list(blocks) == values
+        n = len(values)
+        assert len(blocks) == n
+        if n % 2:
+            assert blocks.median() == values[n // 2]
+        elif n:
+            assert blocks.median() == (values[n // 2 - 1] + values[n // 2]) / 2.0
+        for i in random.sample(xrange(n), min(n, 10)):
+            assert blocks[i] == values[i] and blocks[i - n] == values[i]
+        for e in random.sample(xrange(-1, 52), 5):
+            assert blocks.rank(e) == bisect_left(values, e)
+            assert blocks.rank(e, bisect_right) == bisect_right(values, e)
+            assert blocks.count(e) == values.count(e)
+            assert (e in blocks) == (e in values)
+
+    print "    Random op tests..."
+    for load in (2, 3, 4, 8):
+        values = sorted(random.randrange(50) for i in range(random.randrange(30)))
+        blocks = BlockList(values, load)
+        compare(blocks, values)
+        for i in range(1500):
+            # grow, then shrink, so blocks are both split and merged
+            if random.random() < (0.7 if i < 700 else 0.3) or not values:
+                e = random.randrange(50)
+                blocks.add(e)
+                values.insert(bisect_right(values, e), e)
+            elif random.random() < 0.1:
+                absent = [e for e in range(-5, 55) if e not in values]
+                e = random.choice(absent)
+                try:
+                    blocks.remove(e)
+                    assert False
+                except ValueError:
+                    pass
+            else:
+                e = random.choice(values)
+                blocks.remove(e)
+                values.remove(e)
+            compare(blocks, values)
+        while values:
+            e = random.choice(values)
+            blocks.remove(e)
+            values.remove(e)
+            compare(blocks, values)
+        try:
+            blocks.median()
+            assert False
+        except ValueError:
+            pass
+    print "    passed"
+
+
+if __name__ == "__main__":
+    testBlockList()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+#
+# Crash safe running median: an RBMedian with a write-ahead op log and
+# checkpoints, kept in one directory:
+#
+#   ckpt.<lsn>     snapshot of the tree (RBTree.save) after lsn ops
+#   wal.<lsn>      log of the ops from number lsn on
+#
+# Every add and every remove that took effect is appended to the log
+# as a 9 byte record, the op ('a' or 'r') and the value as a signed 64
+# bit integer, so values have to be ints; anything else is a TypeError
+# and leaves the tracker alone.  Records are buffered and written with
+# one write and one fsync per group commit: once `group` ops are
+# pending, on the first op or poll() at least `delay` seconds after the
+# oldest pending one, or on an explicit commit() or close().  There is
+# no timer, so a caller whose stream can go quiet should call poll()
+# from its wait loop.  An op is durable once its group is.
+#
+# A checkpoint saves the tree to a new snapshot, written to a temporary
+# name, synced and renamed, and starts a new log; older snapshots and
+# logs are removed after that.  Recovery removes a temporary snapshot
+# left by a crash, loads the newest snapshot and replays only the logs
+# written after it, dropping a torn record at the end of the last log,
+# so it costs O(n) for the snapshot plus the ops since the checkpoint,
+# not the whole history.
+#
+# usage: python DurableMedian.py directory < input00.txt
+#        python DurableMedian.py test
+
+import os
+import struct
+import time
+
+from RBMedian import RBMedian
+from RBTree import RBTree
+
+RECORD = struct.Struct('<cq')
+GROUP = 1024
+DELAY = 0.01
+CHECKPOINT = 1 << 20
+
+
+def syncDirectory(directory):
+    """make renames and new files in directory durable"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableMedian(object):
+
+    def __init__(self, directory, group=GROUP, delay=DELAY,
+                 checkpointEvery=CHECKPOINT):
+        self.directory = directory
+        self.group = group
+        self.delay = delay
+        self.checkpointEvery = checkpointEvery
+        self.pending = []
+        self.oldest = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.recover()
+
+    def __len__(self):
+        return len(self.tracker)
+
+    def path(self, kind, lsn):
+        return os.path.join(self.directory, "%s.%d" % (kind, lsn))
+
+    def files(self, kind):
+        """the lsns of the files of one kind, in ascending order"""
+        result = []
+        for name in os.listdir(self.directory):
+            prefix, dot, lsn = name.partition('.')
+            if prefix == kind and lsn.isdigit():
+                result.append(int(lsn))
+        result.sort()
+        return result
+
+    def recover(self):
+        """rebuild the tracker from the newest checkpoint and the logs"""
+        for name in os.listdir(self.directory):
+            if name.startswith('ckpt.') and name.endswith('.tmp'):
+                # a checkpoint cut short before its rename
+                os.remove(os.path.join(self.directory, name))
+        checkpoints = self.files('ckpt')
+        if checkpoints:
+            self.checkpointed = checkpoints[-1]
+            tree = RBTree.load(self.path('ckpt', self.checkpointed))
+            self.tracker = RBMedian.fromTree(tree)
+        else:
+            self.checkpointed = 0
+            self.tracker = RBMedian()
+
+        # the logs are contiguous: replay the records from the
+        # checkpoint on, wherever they are
+        self.lsn = self.checkpointed
+        self.logStart = None
+        add, remove = self.tracker.add, self.tracker.remove
+        for first in self.files('wal'):
+            path = self.path('wal', first)
+            f = open(path, 'rb')
+            data = f.read()
+            f.close()
+            records = len(data) // RECORD.size
+            if len(data) != records * RECORD.size:
+                # a torn record from a crash during a write
+                f = open(path, 'r+b')
+                f.truncate(records * RECORD.size)
+                f.close()
+            if first + records < self.lsn:
+                continue
+            if first > self.lsn:
+                raise ValueError("%s: log records %d to %d are missing" %
+                                 (self.directory, self.lsn, first - 1))
+            for lsn in xrange(self.lsn, first + records):
+                op, e = RECORD.unpack_from(data, (lsn - first) * RECORD.size)
+                if op == 'a':
+                    add(e)
+                else:
+                    remove(e)
+            self.lsn = first + records
+            self.logStart = first
+        if self.logStart is None:
+            self.logStart = self.lsn
+        self.log = open(self.path('wal', self.logStart), 'ab')
+        syncDirectory(self.directory)
+
+    def record(self, op, e):
+        """the log record of an op, TypeError if e is not an int"""
+        if not isinstance(e, (int, long)):
+            raise TypeError("DurableMedian: values must be ints, not %s" %
+                            type(e).__name__)
+        try:
+            return RECORD.pack(op, e)
+        except struct.error:
+            raise TypeError("DurableMedian: %d does not fit in 64 bits" % e)
+
+    def append(self, record):
+        self.pending.append(record)
+        self.lsn += 1
+        now = time.time()
+        if self.oldest is None:
+            self.oldest = now
+        if len(self.pending) >= self.group or now - self.oldest >= self.delay:
+            self.commit()
+        if self.lsn - self.checkpointed >= self.checkpointEvery:
+            self.checkpoint()
+
+    def commit(self):
+        """write and sync the pending log records"""
+        if self.pending:
+            self.log.write(''.join(self.pending))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.pending = []
+        self.oldest = None
+
+    def poll(self):
+        """commit the pending records if the oldest is `delay` seconds
+           old; for callers waiting on a quiet stream"""
+        if self.oldest is not None and time.time() - self.oldest >= self.delay:
+            self.commit()
+
+    def checkpoint(self):
+        """save the tree and start a new log; older files are removed"""
+        self.commit()
+        path = self.path('ckpt', self.lsn)
+        self.tracker.tree.save(path + '.tmp')
+        f = open(path + '.tmp', 'rb')
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(path + '.tmp', path)
+        self.log.close()
+        self.logStart = self.checkpointed = self.lsn
+        self.log = open(self.path('wal', self.lsn), 'ab')
+        syncDirectory(self.directory)
+
+        for lsn in self.files('ckpt'):
+            if lsn < self.checkpointed:
+                os.remove(self.path('ckpt', lsn))
+        for lsn in self.files('wal'):
+            if lsn < self.checkpointed:
+                os.remove(self.path('wal', lsn))
+
+    def close(self):
+        self.commit()
+        self.log.close()
+
+    def add(self, e):
+        record = self.record('a', e)
+        self.tracker.add(e)
+        self.append(record)
+
+    def remove(self, e):
+        """remove one copy of e, ValueError if there is none; failed
+           removes are not logged"""
+        record = self.record('r', e)
+        self.tracker.remove(e)
+        self.append(record)
+
+    def median(self):
+        return self.tracker.median()
+
+
+def testDurable():
+    import random
+    import shutil
+    import tempfile
+    print "--- Testing DurableMedian ---"
+
+    def check(tracker, values):
+        """assert that tracker holds the multiset values"""
+        assert len(tracker) == len(values)
+        held = []
+        for node in tracker.tracker.tree.nodes():
+            held.extend([node.key] * node.count)
+        assert held == sorted(values)
+        n = len(held)
+        if n % 2:
+            assert tracker.median() == held[n // 2]
+        elif n:
+            assert tracker.median() == (held[n // 2 - 1] + held[n // 2]) / 2.0
+        else:
+            try:
+                tracker.median()
+                assert False
+            except ValueError:
+                pass
+
+    def step(tracker, values):
+        """one random op on tracker and values"""
+        e = random.randrange(20)
+        if random.random() < 0.6 or e not in values:
+            if random.random() < 0.5 or not values:
+                tracker.add(e)
+                values.append(e)
+                return
+            e = random.choice(values)
+        tracker.remove(e)
+        values.remove(e)
+
+    directory = tempfile.mkdtemp()
+    try:
+        print "    Crash and recovery tests..."
+        path = os.path.join(directory, 'stream')
+        values = []
+        for i in range(30):
+            tracker = DurableMedian(path, random.choice([1, 3, 100]), 1e9,
+                                    random.choice([5, 17, 1000]))
+            check(tracker, values)
+            for j in range(random.randrange(40)):
+                step(tracker, values)
+            tracker.commit()
+            # ops after the last commit are lost in the crash
+            tracker.group = tracker.checkpointEvery = 1 << 30
+            lost = list(values)
+            for j in range(random.randrange(5)):
+                step(tracker, lost)
+            check(tracker, lost)
+            if random.random() < 0.3:
+                # a crash during a checkpoint, before the rename
+                tracker.tracker.tree.save(tracker.path('ckpt', tracker.lsn)
+                                          + '.tmp')
+            # the crash: the tracker is abandoned without close()
+            del tracker
+            if random.random() < 0.5:
+                # and a torn record at the end of the log
+                last = max(int(name[4:]) for name in os.listdir(path)
+                           if name.startswith('wal.'))
+                f = open(os.path.join(path, 'wal.%d' % last), 'ab')
+                f.write(RECORD.pack('a', 7)[:random.randrange(1, RECORD.size)])
+                f.close()
+        tracker = DurableMedian(path)
+        check(tracker, values)
+        assert not [name for name in os.listdir(path) if name.endswith('.tmp')]
+        tracker.close()
+
+        print "    Poll tests..."
+        path = os.path.join(directory, 'poll')
+        tracker = DurableMedian(path, 1 << 30, 0.01)
+        tracker.add(3)
+        tracker.add(5)
+        assert tracker.pending
+        tracker.poll()
+        time.sleep(0.02)
+        tracker.poll()
+        assert not tracker.pending
+        del tracker
+        tracker = DurableMedian(path)
+        check(tracker, [3, 5])
+        tracker.close()
+
+        print "    Value type tests..."
+        path = os.path.join(directory, 'types')
+        tracker = DurableMedian(path, 1)
+        tracker.add(4)
+        tracker.add(4L)
+        for e in (1.5, '3', 1 << 70, None):
+            for op in (tracker.add, tracker.remove):
+                try:
+                    op(e)
+                    assert False
+                except TypeError:
+                    pass
+        check(tracker, [4, 4])
+        del tracker
+        tracker = DurableMedian(path)
+        check(tracker, [4, 4])
+        tracker.close()
+    finally:
+        shutil.rmtree(directory)
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testDurable()
+        sys.exit(0)
+
+    from MedianStream import run
+
+    tracker = DurableMedian(sys.argv[1])
+    try:
+        run(tracker, sys.stdin, sys.stdout)
+    finally:
+        tracker.close()
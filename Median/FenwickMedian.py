@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Offline median solver for a whole op file.
+#
+# When all ops are known up front (the s/x lists built by main1.py),
+# the values can be coordinate compressed and their counts kept in a
+# Fenwick (binary indexed) tree over the compressed range.  The k-th
+# smallest value is then found by binary lifting over the tree in
+# O(log U), U being the number of distinct values, with no node
+# objects and no rebalancing at all.
+#
+# usage: python FenwickMedian.py < input00.txt
+#        python FenwickMedian.py test
+
+from MedianStream import formatMedian
+
+
+def solve(s, x):
+    """apply the ops s[i] ('a' or 'r') with values x[i] and return the
+       median after every op, or None where main1.py prints Wrong!"""
+    values = sorted(set(x))
+    index = dict((v, i + 1) for i, v in enumerate(values))
+    U = len(values)
+    tree = [0] * (U + 1)
+    counts = [0] * (U + 1)
+    top = 1
+    while top * 2 <= U:
+        top *= 2
+
+    def kth(k):
+        """value of the k-th smallest element, 1 based"""
+        pos = 0
+        step = top
+        while step:
+            nxt = pos + step
+            if nxt <= U and tree[nxt] < k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return values[pos]
+
+    results = []
+    size = 0
+    for op, e in zip(s, x):
+        i = index[e]
+        if op == 'a':
+            delta = 1
+        elif counts[i]:
+            delta = -1
+        else:
+            results.append(None)
+            continue
+        counts[i] += delta
+        size += delta
+        while i <= U:
+            tree[i] += delta
+            i += i & -i
+
+        if not size:
+            results.append(None)
+        elif size % 2:
+            results.append(kth(size // 2 + 1))
+        else:
+            results.append((kth(size // 2) + kth(size // 2 + 1)) / 2.0)
+    return results
+
+
+def testFenwick():
+    import random
+    from bisect import bisect_left, insort
+    print "--- Testing FenwickMedian ---"
+    print "    Random op tests..."
+    # spreads giving 1, a power of two and other numbers of values
+    for spread in (1, 2, 7, 8, 9, 100):
+        for length in (0, 1, 5, 300):
+            s = [random.choice('aar') for i in range(length)]
+            x = [random.randrange(-spread // 2, spread) for i in range(length)]
+            held = []
+            for op, e, m in zip(s, x, solve(s, x)):
+                if op == 'a':
+                    insort(held, e)
+                else:
+                    i = bisect_left(held, e)
+                    if i == len(held) or held[i] != e:
+                        assert m is None
+                        continue
+                    del held[i]
+                n = len(held)
+                if not n:
+                    assert m is None
+                elif n % 2:
+                    assert m == held[n // 2]
+                else:
+                    assert m == (held[n // 2 - 1] + held[n // 2]) / 2.0
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testFenwick()
+        sys.exit(0)
+
+    N = int(raw_input())
+
+    s = []
+    x = []
+    for i in range(0, N):
+        a, b = raw_input().split(' ')
+        s.append(a)
+        x.append(int(b))
+
+    lines = []
+    for m in solve(s, x):
+        if m is None:
+            lines.append("Wrong!")
+        else:
+            lines.append(formatMedian(m))
+    sys.stdout.write('\n'.join(lines) + '\n')
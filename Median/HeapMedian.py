@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# Running median of a multiset kept in two heaps:
+#   low  - max-heap (stored negated) holding the smaller half
+#   high - min-heap holding the larger half
+#
+# low always holds as many elements as high, or one more, so the
+# median is read from the heap tops in O(1).  Removals are lazy: the
+# removed value is only counted in a per-heap table and the stale
+# copy is thrown away once it reaches the top of its heap.
+#
+# usage: python HeapMedian.py < input00.txt
+#        python HeapMedian.py test
+
+from heapq import heappush, heappop, heapify
+
+
+class HeapMedian(object):
+
+    def __init__(self):
+        self.low = []
+        self.high = []
+        # live elements in each heap, not counting stale copies
+        self.lowSize = 0
+        self.highSize = 0
+        # value -> number of stale copies still stored in each heap
+        self.lowDead = {}
+        self.highDead = {}
+        # value -> number of live copies, so bad removals can be caught
+        self.counts = {}
+
+    def __len__(self):
+        return self.lowSize + self.highSize
+
+    def add(self, e):
+        self.counts[e] = self.counts.get(e, 0) + 1
+        if not self.lowSize or e <= -self.low[0]:
+            heappush(self.low, -e)
+            self.lowSize += 1
+        else:
+            heappush(self.high, e)
+            self.highSize += 1
+        self.rebalance()
+
+    def remove(self, e):
+        n = self.counts.get(e, 0)
+        if not n:
+            raise ValueError #cannot find the element to remove
+        if n == 1:
+            del self.counts[e]
+        else:
+            self.counts[e] = n - 1
+
+        # the tops are always live, so anything not above the low top
+        # must be stored in low, and anything above it in high
+        if e <= -self.low[0]:
+            self.lowDead[e] = self.lowDead.get(e, 0) + 1
+            self.lowSize -= 1
+        else:
+            self.highDead[e] = self.highDead.get(e, 0) + 1
+            self.highSize -= 1
+        self.prune()
+        self.rebalance()
+
+    def median(self):
+        if not self.lowSize:
+            raise ValueError
+        if self.lowSize > self.highSize:
+            return -self.low[0]
+        return (-self.low[0] + self.high[0]) / 2.0
+
+    def rebalance(self):
+        if self.lowSize > self.highSize + 1:
+            heappush(self.high, -heappop(self.low))
+            self.lowSize -= 1
+            self.highSize += 1
+        elif self.lowSize < self.highSize:
+            heappush(self.low, -heappop(self.high))
+            self.lowSize += 1
+            self.highSize -= 1
+        else:
+            return
+        self.prune()
+
+    def prune(self):
+        """drop stale copies from the heap tops"""
+        low, dead = self.low, self.lowDead
+        while low and dead:
+            e = -low[0]
+            n = dead.get(e)
+            if not n:
+                break
+            heappop(low)
+            if n == 1:
+                del dead[e]
+            else:
+                dead[e] = n - 1
+
+        high, dead = self.high, self.highDead
+        while high and dead:
+            e = high[0]
+            n = dead.get(e)
+            if not n:
+                break
+            heappop(high)
+            if n == 1:
+                del dead[e]
+            else:
+                dead[e] = n - 1
+
+        # once stale copies outnumber live ones, rebuild the heaps so
+        # memory stays proportional to the live multiset
+        if len(self.low) + len(self.high) > 2 * len(self) + 64:
+            self.low = self.compact(self.low, self.lowDead, -1)
+            self.high = self.compact(self.high, self.highDead, 1)
+
+    def compact(self, heap, dead, sign):
+        result = []
+        for stored in heap:
+            e = sign * stored
+            n = dead.get(e)
+            if n:
+                if n == 1:
+                    del dead[e]
+                else:
+                    dead[e] = n - 1
+            else:
+                result.append(stored)
+        heapify(result)
+        return result
+
+
+def testHeapMedian():
+    from bisect import insort
+    from random import random, randrange
+    print "--- Testing HeapMedian ---"
+    print "    Random op tests..."
+
+    def live(heap, dead, sign):
+        """the live values stored in heap, sorted"""
+        dead = dict(dead)
+        result = []
+        for e in sorted(sign * stored for stored in heap):
+            if dead.get(e):
+                dead[e] -= 1
+            else:
+                result.append(e)
+        assert not sum(dead.values())
+        return result
+
+    for spread in (1, 4, 50):
+        tracker = HeapMedian()
+        values = []
+        for i in xrange(4000):
+            if values and random() < 0.5:
+                e = values[randrange(len(values))]
+                tracker.remove(e)
+                values.remove(e)
+            elif random() < 0.05:
+                try:
+                    tracker.remove(spread + randrange(3))
+                    assert False
+                except ValueError:
+                    pass
+            else:
+                e = randrange(spread)
+                tracker.add(e)
+                insort(values, e)
+            n = len(values)
+            assert len(tracker) == n
+            low = live(tracker.low, tracker.lowDead, -1)
+            high = live(tracker.high, tracker.highDead, 1)
+            assert low + high == values and len(low) - len(high) in (0, 1)
+            assert len(tracker.low) + len(tracker.high) <= 2 * n + 65
+            if n % 2:
+                assert tracker.median() == values[n // 2]
+            elif n:
+                assert tracker.median() == (values[n // 2 - 1] + values[n // 2]) / 2.0
+            else:
+                try:
+                    tracker.median()
+                    assert False
+                except ValueError:
+                    pass
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testHeapMedian()
+        sys.exit(0)
+
+    N = int(raw_input())
+
+    tracker = HeapMedian()
+    for i in range(0, N):
+        a, b = raw_input().split(' ')
+        try:
+            if a == 'a':
+                tracker.add(int(b))
+            else:
+                tracker.remove(int(b))
+            m = tracker.median()
+            if m == int(m):
+                print str(int(m))
+            else:
+                print m
+        except ValueError:
+            print "Wrong!"
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# Running medians for many independent streams in one process.
+#
+# The main*.py drivers keep their state in module globals, so there is
+# a single stream per process.  A MedianRegistry keeps one tracker per
+# key instead, created on the first add to that key, and takes ops of
+# the form
+#
+#   N
+#   a key value
+#   r key value
+#   ...
+#
+# printing the median of that key's stream after each op, or Wrong! as
+# main1.py does.  The trackers are BlockLists: a stream of a few hundred
+# values is a single array block, about the smallest tracker there is.
+#
+# Trackers are kept in least recently used order.  Whenever the
+# estimated memory (or the number of keys) goes over its cap, the least
+# recently used trackers are dropped, and trackers not touched for more
+# than `idle` seconds are dropped too.  A stream that was evicted simply
+# starts again empty on its next add.
+#
+# The memory figure is an estimate, not a measurement: fixed costs per
+# tracker and per registry entry, measured for BlockLists on 64 bit
+# CPython 2.7, plus sys.getsizeof of every key and 8 bytes per value.
+# Other factories or interpreters can be off from it either way.
+#
+# usage: python MedianRegistry.py [maxBytes] [idle] < ops.txt
+
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+from BlockList import BlockList
+from MedianStream import formatMedian, readTokens
+
+# footprint of a BlockList holding one value, of the OrderedDict link
+# and [tracker, last use] list of its entry, and of one more value,
+# used for the memory cap; the keys are counted with sys.getsizeof
+TRACKER_BYTES = 1600
+ENTRY_BYTES = 380
+ITEM_BYTES = array('l').itemsize
+
+
+class MedianRegistry(object):
+
+    def __init__(self, maxBytes=None, maxKeys=None, idle=None,
+                 factory=BlockList, clock=time.time, onEvict=None):
+        self.maxBytes = maxBytes
+        self.maxKeys = maxKeys
+        self.idle = idle
+        self.factory = factory
+        self.clock = clock
+        self.onEvict = onEvict
+        # key -> [tracker, last use], least recently used first
+        self.trackers = OrderedDict()
+        self.elements = 0
+        self.keyBytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def __contains__(self, key):
+        return key in self.trackers
+
+    def memory(self):
+        """estimated bytes held by the trackers"""
+        return (len(self.trackers) * (TRACKER_BYTES + ENTRY_BYTES) +
+                self.keyBytes + self.elements * ITEM_BYTES)
+
+    def touch(self, key, create=False):
+        """return the entry of key moved to the most recently used end,
+           or None if there is no tracker for key"""
+        now = self.clock()
+        self.expire(now)
+        entry = self.trackers.pop(key, None)
+        if entry is None:
+            if not create:
+                return None
+            entry = [self.factory(), now]
+            self.keyBytes += sys.getsizeof(key)
+        entry[1] = now
+        self.trackers[key] = entry
+        return entry
+
+    def add(self, key, e):
+        entry = self.touch(key, True)
+        entry[0].add(e)
+        self.elements += 1
+        self.shrink()
+
+    def remove(self, key, e):
+        """remove one copy of e from the stream of key, ValueError if
+           there is none"""
+        entry = self.touch(key)
+        if entry is None:
+            raise ValueError("MedianRegistry.remove: unknown key")
+        tracker = entry[0]
+        tracker.remove(e)
+        self.elements -= 1
+        if not len(tracker):
+            del self.trackers[key]
+            self.keyBytes -= sys.getsizeof(key)
+
+    def median(self, key):
+        entry = self.trackers.get(key)
+        if entry is None:
+            raise ValueError
+        return entry[0].median()
+
+    def evict(self):
+        """drop the least recently used tracker"""
+        key, (tracker, last) = self.trackers.popitem(last=False)
+        self.elements -= len(tracker)
+        self.keyBytes -= sys.getsizeof(key)
+        self.evictions += 1
+        if self.onEvict is not None:
+            self.onEvict(key, tracker)
+
+    def shrink(self):
+        """evict until the caps hold again; the most recently used
+           tracker is always kept"""
+        while len(self.trackers) > 1 and (
+                self.maxKeys is not None and
+                len(self.trackers) > self.maxKeys or
+                self.maxBytes is not None and
+                self.memory() > self.maxBytes):
+            self.evict()
+
+    def expire(self, now=None):
+        """evict the trackers idle for more than self.idle seconds"""
+        if self.idle is None:
+            return
+        if now is None:
+            now = self.clock()
+        trackers = self.trackers
+        while trackers:
+            entry = trackers[next(iter(trackers))]
+            if now - entry[1] <= self.idle:
+                break
+            self.evict()
+
+
+def run(registry, stream, out):
+    """apply the keyed ops read from stream to registry and write one
+       line per op to out; returns the number of ops applied"""
+    total = None
+    done = 0
+    pending = []
+    for tokens in readTokens(stream):
+        if total is None:
+            total = int(tokens[0])
+            tokens = tokens[1:]
+        pending.extend(tokens)
+        lines = []
+        n = len(pending) // 3 * 3
+        for i in xrange(0, n, 3):
+            if done == total:
+                break
+            op, key, e = pending[i:i + 3]
+            try:
+                if op == 'a':
+                    registry.add(key, int(e))
+                else:
+                    registry.remove(key, int(e))
+                lines.append(formatMedian(registry.median(key)))
+            except ValueError:
+                lines.append("Wrong!")
+            done += 1
+        del pending[:n]
+        if lines:
+            out.write('\n'.join(lines))
+            out.write('\n')
+            out.flush()
+        if done == total:
+            break
+    return done
+
+
+if __name__ == "__main__":
+
+    maxBytes = idle = None
+    if len(sys.argv) > 1:
+        maxBytes = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        idle = float(sys.argv[2])
+    run(MedianRegistry(maxBytes, idle=idle), sys.stdin, sys.stdout)
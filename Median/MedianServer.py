@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Network server around one long lived median tracker.
+#
+# Clients connect over TCP or a Unix socket and send the ops of
+# input00.txt one per line, plus an m query:
+#
+#   a 5        add 5, reply with the median
+#   r 5        remove 5, reply with the median
+#   m          reply with the median
+#
+# Every line gets one reply line, the median or Wrong! as in main1.py,
+# or Error for a line that is not an op.  Clients may pipeline: all the
+# complete lines of one read are applied in order and their replies go
+# out in one write.  All clients share the tracker; the server runs in
+# one thread, so ops are applied one at a time in the order they are
+# read.
+#
+# This is Python 2 code, so the event loop is asyncore rather than
+# asyncio.
+#
+# usage: python MedianServer.py [tree|heap|skiplist|blocks] [host:port|path]
+
+import asyncore
+import os
+import socket
+import stat
+
+from MedianStream import BACKENDS, formatMedian
+
+READ = 1 << 16
+# stop reading from a client while this much output is queued for it
+BACKLOG = 1 << 20
+
+
+class MedianHandler(asyncore.dispatcher):
+
+    def __init__(self, sock, tracker, map=None):
+        asyncore.dispatcher.__init__(self, sock, map)
+        self.tracker = tracker
+        self.inbuf = ''
+        self.outbuf = ''
+        self.closing = False
+
+    def readable(self):
+        return not self.closing and len(self.outbuf) < BACKLOG
+
+    def writable(self):
+        return bool(self.outbuf)
+
+    def handle_read(self):
+        data = self.recv(READ)
+        if not data:
+            return
+        lines = (self.inbuf + data).split('\n')
+        self.inbuf = lines.pop()
+        replies = [self.reply(line) for line in lines]
+        if replies:
+            self.outbuf += '\n'.join(replies) + '\n'
+
+    def reply(self, line):
+        tracker = self.tracker
+        words = line.split()
+        if len(words) == 2 and words[0] in ('a', 'r'):
+            try:
+                e = int(words[1])
+            except ValueError:
+                return "Error"
+        elif words != ['m']:
+            return "Error"
+        try:
+            if words[0] == 'a':
+                tracker.add(e)
+            elif words[0] == 'r':
+                tracker.remove(e)
+            return formatMedian(tracker.median())
+        except ValueError:
+            return "Wrong!"
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+        if self.closing and not self.outbuf:
+            self.close()
+
+    def handle_close(self):
+        # the client may close its end right after its last op: send
+        # the replies still queued before closing, unless sending is
+        # what failed
+        if self.closing or not self.outbuf:
+            self.close()
+        self.closing = True
+
+
+class MedianServer(asyncore.dispatcher):
+
+    def __init__(self, tracker, address, map=None):
+        """serve tracker on address: a (host, port) pair for TCP or a
+           path for a Unix socket"""
+        asyncore.dispatcher.__init__(self, map=map)
+        self.tracker = tracker
+        if isinstance(address, str):
+            if os.path.exists(address):
+                # only a stale socket is removed, never any other file
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise ValueError("%s exists and is not a socket" % address)
+                os.unlink(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.address = self.socket.getsockname()
+        self.listen(128)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            MedianHandler(pair[0], self.tracker, self._map)
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    backend = 'tree'
+    address = ('127.0.0.1', 7878)
+    if len(sys.argv) > 1:
+        backend = sys.argv[1]
+    if len(sys.argv) > 2:
+        if ':' in sys.argv[2]:
+            host, port = sys.argv[2].rsplit(':', 1)
+            address = (host, int(port))
+        else:
+            address = sys.argv[2]
+    if backend not in BACKENDS:
+        print >> sys.stderr, "unknown backend %r, use one of: %s" % \
+            (backend, ', '.join(sorted(BACKENDS)))
+        sys.exit(2)
+
+    try:
+        server = MedianServer(BACKENDS[backend](), address)
+    except ValueError, e:
+        print >> sys.stderr, e
+        sys.exit(2)
+    print >> sys.stderr, "serving %s median on %s" % (backend, server.address)
+    asyncore.loop()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Streaming driver for the median op files (see input00.txt):
+#
+#   N
+#   a 1
+#   r 2
+#   ...
+#
+# The drivers in main*.py read every op into two lists before applying
+# any of them.  Here stdin is read in large binary chunks, every chunk
+# is split into tokens in one go, and each op is applied as soon as it
+# is parsed, so memory only grows with the tracker and the output of a
+# chunk is written before the next chunk is read.
+#
+# usage: python MedianStream.py [tree|heap|skiplist|blocks|sketch] < input00.txt
+#        python MedianStream.py test
+
+import sys
+
+from BlockList import BlockList
+from HeapMedian import HeapMedian
+from RBMedian import RBMedian
+from SketchMedian import SketchMedian
+from SkipList import SkipList
+
+CHUNK = 1 << 16
+
+BACKENDS = {
+    'tree': RBMedian,
+    'heap': HeapMedian,
+    'skiplist': SkipList,
+    'blocks': BlockList,
+    'sketch': SketchMedian,
+}
+
+
+def formatMedian(m):
+    if m == int(m):
+        return str(int(m))
+    return str(m)
+
+
+def readTokens(stream, chunkSize=CHUNK):
+    """yield the whitespace separated tokens of stream, one list per
+       chunk; a token cut by the chunk boundary is carried over"""
+    tail = ''
+    while 1:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            break
+        tokens = (tail + chunk).split()
+        if tokens and not chunk[-1].isspace():
+            tail = tokens.pop()
+        else:
+            tail = ''
+        if tokens:
+            yield tokens
+    if tail:
+        yield [tail]
+
+
+def run(tracker, stream, out, chunkSize=CHUNK):
+    """apply the ops read from stream to tracker and write one line
+       per op to out; returns the number of ops applied"""
+    add, remove, median = tracker.add, tracker.remove, tracker.median
+    total = None
+    done = 0
+    op = None
+    for tokens in readTokens(stream, chunkSize):
+        lines = []
+        i = 0
+        if total is None:
+            total = int(tokens[0])
+            i = 1
+        n = len(tokens)
+        while i < n and done < total:
+            if op is None:
+                op = tokens[i]
+                i += 1
+                if i == n:
+                    # the value is in the next chunk
+                    break
+            try:
+                if op == 'a':
+                    add(int(tokens[i]))
+                else:
+                    remove(int(tokens[i]))
+                lines.append(formatMedian(median()))
+            except ValueError:
+                lines.append("Wrong!")
+            op = None
+            i += 1
+            done += 1
+        if lines:
+            out.write('\n'.join(lines))
+            out.write('\n')
+            out.flush()
+        if done == total:
+            break
+    return done
+
+
+def testStream():
+    import random
+    from bisect import bisect_left, insort
+    from StringIO import StringIO
+    print "--- Testing MedianStream ---"
+
+    def expected(ops, total):
+        """the output of main1.py for the first total ops"""
+        held = []
+        lines = []
+        for op, e in ops[:total]:
+            if op == 'a':
+                insort(held, e)
+            else:
+                i = bisect_left(held, e)
+                if i == len(held) or held[i] != e:
+                    lines.append("Wrong!")
+                    continue
+                del held[i]
+            n = len(held)
+            if not n:
+                lines.append("Wrong!")
+            elif n % 2:
+                lines.append(formatMedian(held[n // 2]))
+            else:
+                lines.append(formatMedian((held[n // 2 - 1] + held[n // 2]) / 2.0))
+        return ''.join(line + '\n' for line in lines)
+
+    print "    Chunk boundary tests..."
+    for i in range(30):
+        ops = [(random.choice('aar'), random.randrange(-20, 1000))
+               for j in range(random.randrange(40))]
+        # sometimes the file holds more ops than its header says
+        total = len(ops) - random.randrange(min(3, len(ops) + 1))
+        text = "%d\n" % total + ''.join("%s %d\n" % op for op in ops)
+        if random.random() < 0.3:
+            text = text.rstrip('\n')
+        if random.random() < 0.3:
+            text = text.replace('\n', ' \r\n')
+        want = expected(ops, total)
+        for chunkSize in (1, 2, 3, 5, 8, 13, 1 << 16):
+            out = StringIO()
+            done = run(RBMedian(), StringIO(text), out, chunkSize)
+            assert done == total and out.getvalue() == want
+    out = StringIO()
+    assert run(RBMedian(), StringIO(""), out) == 0 and out.getvalue() == ""
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testStream()
+        sys.exit(0)
+
+    backend = 'tree'
+    if len(sys.argv) > 1:
+        backend = sys.argv[1]
+    if backend not in BACKENDS:
+        print >> sys.stderr, "unknown backend %r, use one of: %s" % \
+            (backend, ', '.join(sorted(BACKENDS)))
+        sys.exit(2)
+
+    run(BACKENDS[backend](), sys.stdin, sys.stdout)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#
+# Running median over a sorted numpy array, applying the ops a chunk
+# at a time instead of one bisect + list.insert per op (main1.py).
+#
+# For a chunk of c ops:
+#
+#   - the remove ops that main1.py would reject (value not present at
+#     that point) are found for all values at once from a clamped
+#     running count per value;
+#   - the median after every op of the chunk is read from the count of
+#     elements <= w for a small set of candidate values w: the chunk's
+#     added values plus the 4c array elements around the middle, which
+#     is where any median of the chunk has to come from;
+#   - the adds and the removes that took effect are then merged into
+#     the sorted array with one np.insert and one np.delete.
+#
+# So each chunk costs O(n + c^2) in vectorized numpy code, instead of c
+# O(n) memmoves driven from Python.
+#
+# usage: python NumpyMedian.py [chunk] < input00.txt
+#        python NumpyMedian.py test
+
+import numpy as np
+
+from MedianStream import formatMedian, readTokens
+
+CHUNK = 512
+
+
+class NumpyMedian(object):
+
+    def __init__(self, dtype=np.int64):
+        self.data = np.empty(0, dtype)
+
+    def __len__(self):
+        return len(self.data)
+
+    def apply(self, ops, values):
+        """apply the ops ('a' or 'r') with their values and return the
+           median after each op, or None where main1.py prints Wrong!"""
+        data = self.data
+        n = len(data)
+        values = np.asarray(values, data.dtype)
+        c = len(values)
+        if not c:
+            return []
+        delta = np.where(np.asarray(ops) == 'a', 1, -1)
+
+        # Running count of every value through the chunk, starting from
+        # its count in data and never going below zero: a remove fails
+        # exactly when it would take the count to a new low below zero.
+        order = np.lexsort((np.arange(c), values))
+        v = values[order]
+        d = delta[order]
+        start = np.ones(c, bool)
+        start[1:] = v[1:] != v[:-1]
+        group = np.cumsum(start) - 1
+        first = np.flatnonzero(start)
+        base = (np.searchsorted(data, v[first], 'right') -
+                np.searchsorted(data, v[first], 'left'))
+        csum = np.cumsum(d)
+        running = base[group] + csum - (csum[first] - d[first])[group]
+        # running minimum within each group: later groups are shifted
+        # down far enough not to see the values of earlier ones
+        shift = (group[-1] - group) * (2 * (n + c) + 2)
+        low = np.minimum(np.minimum.accumulate(running + shift) - shift, 0)
+        before = np.zeros(c, low.dtype)
+        before[1:] = low[:-1]
+        before[start] = 0
+        failed = np.empty(c, bool)
+        failed[order] = low < before
+        effective = np.where(failed, 0, delta)
+
+        # candidates for the median after every op
+        mid = n // 2
+        lo = max(0, mid - 2 * c - 2)
+        hi = min(n, mid + 2 * c + 3)
+        added = values[delta > 0]
+        cand = np.unique(np.concatenate((data[lo:hi], added)))
+        if not len(cand):
+            # nothing held and nothing added: every op is a failed remove
+            return [None] * c
+        # le[i, j]: number of elements <= cand[j] after op i
+        le = np.cumsum(effective[:, None] * (values[:, None] <= cand[None, :]),
+                       axis=0)
+        le += np.searchsorted(data, cand, 'right')[None, :]
+        size = n + np.cumsum(effective)
+        lower = (le <= ((size - 1) // 2)[:, None]).sum(axis=1)
+        upper = (le <= (size // 2)[:, None]).sum(axis=1)
+        empty = failed | (size == 0)
+        lower[empty] = upper[empty] = 0
+        lower = cand[lower]
+        upper = cand[upper]
+
+        results = []
+        for i, odd in enumerate((size % 2).tolist()):
+            if empty[i]:
+                results.append(None)
+            elif odd:
+                results.append(lower[i].item())
+            else:
+                results.append((lower[i].item() + upper[i].item()) / 2.0)
+
+        # merge the chunk into data
+        added = np.sort(added)
+        data = np.insert(data, np.searchsorted(data, added), added)
+        removed = np.sort(values[effective < 0])
+        if len(removed):
+            # one position per removed copy, counting along runs of
+            # equal values
+            run = np.arange(len(removed)) - np.searchsorted(removed, removed)
+            data = np.delete(data, np.searchsorted(data, removed) + run)
+        self.data = data
+        return results
+
+    def median(self):
+        n = len(self.data)
+        if not n:
+            raise ValueError
+        if n % 2:
+            return self.data[n // 2].item()
+        return (self.data[n // 2 - 1].item() + self.data[n // 2].item()) / 2.0
+
+
+def run(tracker, stream, out, chunk=CHUNK):
+    """apply the op file read from stream to tracker, chunk ops at a
+       time, and write one line per op to out"""
+    total = None
+    pending = []
+    done = 0
+
+    def flush(tokens):
+        medians = tracker.apply(tokens[0::2], np.array(tokens[1::2]).astype(int))
+        lines = []
+        for m in medians:
+            if m is None:
+                lines.append("Wrong!")
+            else:
+                lines.append(formatMedian(m))
+        out.write('\n'.join(lines))
+        out.write('\n')
+        out.flush()
+        return len(medians)
+
+    for tokens in readTokens(stream):
+        if total is None:
+            total = int(tokens[0])
+            tokens = tokens[1:]
+        pending.extend(tokens)
+        del pending[2 * (total - done):]
+        while len(pending) >= 2 * chunk:
+            done += flush(pending[:2 * chunk])
+            del pending[:2 * chunk]
+        if done == total:
+            break
+    if len(pending) >= 2:
+        done += flush(pending[:len(pending) // 2 * 2])
+    return done
+
+
+def testNumpyMedian():
+    import random
+    from bisect import bisect_left, insort
+    print "--- Testing NumpyMedian ---"
+
+    def expected(ops, values, held):
+        results = []
+        for op, e in zip(ops, values):
+            if op == 'a':
+                insort(held, e)
+            else:
+                i = bisect_left(held, e)
+                if i == len(held) or held[i] != e:
+                    results.append(None)
+                    continue
+                del held[i]
+            n = len(held)
+            if not n:
+                results.append(None)
+            elif n % 2:
+                results.append(held[n // 2])
+            else:
+                results.append((held[n // 2 - 1] + held[n // 2]) / 2.0)
+        return results
+
+    print "    Chunk boundary tests..."
+    # an empty start, removes only, and removes emptying the array
+    for chunks in ([(['r', 'r'], [1, 2])],
+                   [(['a'], [1]), (['r', 'r', 'r'], [1, 1, 2]), (['r'], [3])],
+                   [(['a', 'a', 'r'], [5, 5, 5]), (['r', 'r'], [5, 5])],
+                   [(['a', 'a'], [1, 2]), (['r', 'r'], [2, 1]), (['a'], [3])]):
+        tracker = NumpyMedian()
+        held = []
+        for ops, values in chunks:
+            assert tracker.apply(ops, values) == expected(ops, values, held)
+            assert tracker.data.tolist() == held
+
+    print "    Op count tests..."
+    import StringIO
+    for chunk in (1, 2, 5):
+        out = StringIO.StringIO()
+        ops = "3\n" + "a 1\n" * 10
+        assert run(NumpyMedian(), StringIO.StringIO(ops), out, chunk) == 3
+        assert out.getvalue() == "1\n1\n1\n"
+    out = StringIO.StringIO()
+    assert run(NumpyMedian(), StringIO.StringIO(""), out) == 0
+    assert out.getvalue() == ""
+
+    print "    Random op tests..."
+    for chunk in (1, 2, 7, 64):
+        tracker = NumpyMedian()
+        held = []
+        for i in range(40):
+            ops = [random.choice('aar') for j in range(chunk)]
+            values = [random.randrange(10) for j in range(chunk)]
+            assert tracker.apply(ops, values) == expected(ops, values, held)
+            assert tracker.data.tolist() == held
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testNumpyMedian()
+        sys.exit(0)
+
+    chunk = CHUNK
+    if len(sys.argv) > 1:
+        chunk = int(sys.argv[1])
+    run(NumpyMedian(), sys.stdin, sys.stdout, chunk)
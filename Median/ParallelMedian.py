@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# Keyed median streams (see MedianRegistry.py) spread over processes.
+#
+# Keys are hash partitioned over a fixed set of worker processes, so
+# every stream lives in exactly one worker, which keeps its trackers
+# (RBMedian, on top of RBTree) for the whole run.  This is why plain
+# multiprocessing.Process workers with a Pipe each are used rather than
+# a Pool: a Pool hands tasks to whichever worker is free, but the ops of
+# a key have to reach the worker holding its tracker.
+#
+# The parent reads the op file in batches, splits every batch by worker
+# and sends each worker its share in one message.  The workers apply
+# their ops and send back the output lines, which the parent puts back
+# in input order before writing them.
+#
+# usage: python ParallelMedian.py [workers] < ops.txt
+
+import multiprocessing
+
+from MedianRegistry import MedianRegistry
+from MedianStream import formatMedian, readTokens
+from RBMedian import RBMedian
+
+BATCH = 1 << 16
+
+
+def work(conn, factory):
+    """worker loop: apply every batch received on conn, reply with its
+       output lines; a None batch ends the loop"""
+    registry = MedianRegistry(factory=factory)
+    add, remove, median = registry.add, registry.remove, registry.median
+    while 1:
+        batch = conn.recv()
+        if batch is None:
+            break
+        ops, keys, values = batch
+        lines = []
+        for i in xrange(len(ops)):
+            key = keys[i]
+            try:
+                if ops[i] == 'a':
+                    add(key, int(values[i]))
+                else:
+                    remove(key, int(values[i]))
+                lines.append(formatMedian(median(key)))
+            except ValueError:
+                lines.append("Wrong!")
+        conn.send(lines)
+    conn.close()
+
+
+class ParallelMedian(object):
+
+    def __init__(self, workers=None, factory=RBMedian):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.conns = []
+        self.procs = []
+        for i in xrange(workers):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=work, args=(child, factory))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+
+    def apply(self, ops, keys, values):
+        """apply the ops to the streams of keys and return the output
+           lines in input order"""
+        n = len(self.conns)
+        batches = [([], [], []) for i in xrange(n)]
+        owner = []
+        for i in xrange(len(ops)):
+            w = hash(keys[i]) % n
+            owner.append(w)
+            batch = batches[w]
+            batch[0].append(ops[i])
+            batch[1].append(keys[i])
+            batch[2].append(values[i])
+        for w in xrange(n):
+            if batches[w][0]:
+                self.conns[w].send(batches[w])
+        results = []
+        for w in xrange(n):
+            if batches[w][0]:
+                results.append(iter(self.conns[w].recv()))
+            else:
+                results.append(None)
+        return [next(results[w]) for w in owner]
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+        self.conns = []
+        self.procs = []
+
+
+def run(runner, stream, out, batch=BATCH):
+    """apply the keyed op file read from stream through runner and write
+       one line per op to out; returns the number of ops applied"""
+    total = None
+    done = 0
+    pending = []
+
+    def flush(tokens):
+        lines = runner.apply(tokens[0::3], tokens[1::3], tokens[2::3])
+        out.write('\n'.join(lines))
+        out.write('\n')
+        out.flush()
+        return len(lines)
+
+    for tokens in readTokens(stream):
+        if total is None:
+            total = int(tokens[0])
+            tokens = tokens[1:]
+        pending.extend(tokens)
+        del pending[3 * (total - done):]
+        while len(pending) >= 3 * batch:
+            done += flush(pending[:3 * batch])
+            del pending[:3 * batch]
+    if len(pending) >= 3:
+        done += flush(pending[:len(pending) // 3 * 3])
+    return done
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    workers = None
+    if len(sys.argv) > 1:
+        workers = int(sys.argv[1])
+    runner = ParallelMedian(workers)
+    try:
+        run(runner, sys.stdin, sys.stdout)
+    finally:
+        runner.close()
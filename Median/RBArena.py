@@ -0,0 +1,785 @@
+#!/usr/bin/env python
+#
+# Red/Black tree with its nodes kept in an arena of parallel arrays.
+#
+# RBTree.py allocates a full RBNode object (with its own __dict__) for
+# every element.  Here a node is just an int indexing into one array
+# per field, so the per node overhead drops to a few bytes per field
+# plus the references to key and value.  Slot 0 is the sentinel, which
+# doubles as "no node" since it is false.  Deleted slots are chained
+# into a free list through the right column and reused by later
+# inserts.
+#
+# ArenaRBList and ArenaRBDict offer the same interface as RBList and
+# RBDict in RBTree.py; node level methods (findNode, nextNode, select,
+# ...) take and return slot numbers instead of RBNode objects.
+
+import string
+from array import array
+from operator import itemgetter
+
+BLACK = 0
+RED = 1
+
+
+class ArenaRBTree(object):
+
+    def __init__(self, cmpfn=cmp, unique=True):
+        # see RBTree.__init__() for unique
+        self.unique = unique
+        # changing the comparison function for an existing tree is dangerous!
+        self.__cmp = cmpfn
+        self.clear()
+
+    def clear(self):
+        """delete all entries"""
+        # slot 0 is the sentinel
+        self.left = array('i', [0])
+        self.right = array('i', [0])
+        self.parent = array('i', [0])
+        self.color = array('b', [BLACK])
+        self.counts = array('i', [0])
+        self.size = array('i', [0])
+        self.key = [None]
+        self.value = self.valueColumn()
+        self.root = 0
+        self.freeHead = 0
+        self.elements = 0
+
+    def valueColumn(self):
+        return [None]
+
+    def __len__(self):
+        return self.elements
+
+    def __str__(self):
+        return "<ArenaRBTree object>"
+
+    def __repr__(self):
+        return "<ArenaRBTree object>"
+
+    def __iter__(self):
+        value, nextNode = self.value, self.nextNode
+        cur = self.firstNode()
+        while cur:
+            yield value[cur]
+            cur = nextNode(cur)
+
+    def allocate(self, key, value, parent):
+        """return a fresh red slot holding key and value"""
+        x = self.freeHead
+        if x:
+            self.freeHead = self.right[x]
+            self.left[x] = self.right[x] = 0
+            self.parent[x] = parent
+            self.color[x] = RED
+            self.counts[x] = 1
+            self.size[x] = 1
+            self.key[x] = key
+            self.value[x] = value
+            return x
+        x = len(self.key)
+        self.left.append(0)
+        self.right.append(0)
+        self.parent.append(parent)
+        self.color.append(RED)
+        self.counts.append(1)
+        self.size.append(1)
+        self.key.append(key)
+        if self.value is not self.key:
+            self.value.append(value)
+        return x
+
+    def release(self, x):
+        """put slot x on the free list"""
+        self.key[x] = self.value[x] = None
+        self.left[x] = self.parent[x] = 0
+        self.right[x] = self.freeHead
+        self.freeHead = x
+
+    def updateNode(self, x):
+        """recompute the subtree size of x from its children"""
+        size = self.size
+        size[x] = size[self.left[x]] + size[self.right[x]] + 1
+
+    def updatePath(self, x):
+        """recompute the subtree sizes from x up to the root"""
+        parent = self.parent
+        while x:
+            self.updateNode(x)
+            x = parent[x]
+
+    def rotateLeft(self, x):
+        left, right, parent = self.left, self.right, self.parent
+        y = right[x]
+
+        # establish x.right link
+        right[x] = left[y]
+        if left[y]:
+            parent[left[y]] = x
+
+        # establish y.parent link
+        p = parent[x]
+        parent[y] = p
+        if p:
+            if x == left[p]:
+                left[p] = y
+            else:
+                right[p] = y
+        else:
+            self.root = y
+
+        # link x and y
+        left[y] = x
+        parent[x] = y
+
+        # x is now below y, so fix its size first
+        self.updateNode(x)
+        self.updateNode(y)
+
+    def rotateRight(self, x):
+        left, right, parent = self.left, self.right, self.parent
+        y = left[x]
+
+        # establish x.left link
+        left[x] = right[y]
+        if right[y]:
+            parent[right[y]] = x
+
+        # establish y.parent link
+        p = parent[x]
+        parent[y] = p
+        if p:
+            if x == right[p]:
+                right[p] = y
+            else:
+                left[p] = y
+        else:
+            self.root = y
+
+        # link x and y
+        right[y] = x
+        parent[x] = y
+
+        # x is now below y, so fix its size first
+        self.updateNode(x)
+        self.updateNode(y)
+
+    def insertFixup(self, x):
+        left, right, parent, color = \
+            self.left, self.right, self.parent, self.color
+
+        while x != self.root and color[parent[x]] == RED:
+            p = parent[x]
+            g = parent[p]
+            if p == left[g]:
+                y = right[g]
+                if color[y] == RED:
+                    # uncle is RED
+                    color[p] = BLACK
+                    color[y] = BLACK
+                    color[g] = RED
+                    x = g
+                else:
+                    # uncle is BLACK
+                    if x == right[p]:
+                        # make x a left child
+                        x = p
+                        self.rotateLeft(x)
+                        p = parent[x]
+                    # recolor and rotate
+                    color[p] = BLACK
+                    color[g] = RED
+                    self.rotateRight(g)
+            else:
+                # mirror image of above code
+                y = left[g]
+                if color[y] == RED:
+                    color[p] = BLACK
+                    color[y] = BLACK
+                    color[g] = RED
+                    x = g
+                else:
+                    if x == left[p]:
+                        x = p
+                        self.rotateRight(x)
+                        p = parent[x]
+                    color[p] = BLACK
+                    color[g] = RED
+                    self.rotateLeft(g)
+
+        color[self.root] = BLACK
+
+    def insertNode(self, key, value):
+        """insert key and return its slot"""
+        # we aren't interested in the value, we just
+        # want the TypeError raised if appropriate
+        hash(key)
+
+        cmpfn, keys, left, right = self.__cmp, self.key, self.left, self.right
+        current = self.root
+        parent = 0
+        rc = 0
+        while current:
+            rc = cmpfn(key, keys[current])
+            if rc == 0:
+                # see RBTree.insertNode()
+                if self.unique == False:
+                    self.counts[current] += 1
+                else:
+                    print "Warning: This element is already in the list ... ignored!"
+                return current
+            parent = current
+            if rc < 0:
+                current = left[current]
+            else:
+                current = right[current]
+
+        x = self.allocate(key, value, parent)
+        self.elements = self.elements + 1
+
+        if parent:
+            if rc < 0:
+                left[parent] = x
+            else:
+                right[parent] = x
+        else:
+            self.root = x
+
+        # every ancestor of x has gained one node
+        self.updatePath(parent)
+
+        self.insertFixup(x)
+        return x
+
+    def deleteFixup(self, x):
+        left, right, parent, color = \
+            self.left, self.right, self.parent, self.color
+
+        while x != self.root and color[x] == BLACK:
+            p = parent[x]
+            if x == left[p]:
+                w = right[p]
+                if color[w] == RED:
+                    color[w] = BLACK
+                    color[p] = RED
+                    self.rotateLeft(p)
+                    w = right[p]
+
+                if color[left[w]] == BLACK and color[right[w]] == BLACK:
+                    color[w] = RED
+                    x = p
+                else:
+                    if color[right[w]] == BLACK:
+                        color[left[w]] = BLACK
+                        color[w] = RED
+                        self.rotateRight(w)
+                        w = right[p]
+
+                    color[w] = color[p]
+                    color[p] = BLACK
+                    color[right[w]] = BLACK
+                    self.rotateLeft(p)
+                    x = self.root
+
+            else:
+                w = left[p]
+                if color[w] == RED:
+                    color[w] = BLACK
+                    color[p] = RED
+                    self.rotateRight(p)
+                    w = left[p]
+
+                if color[right[w]] == BLACK and color[left[w]] == BLACK:
+                    color[w] = RED
+                    x = p
+                else:
+                    if color[left[w]] == BLACK:
+                        color[right[w]] = BLACK
+                        color[w] = RED
+                        self.rotateLeft(w)
+                        w = left[p]
+
+                    color[w] = color[p]
+                    color[p] = BLACK
+                    color[left[w]] = BLACK
+                    self.rotateRight(p)
+                    x = self.root
+
+        color[x] = BLACK
+
+    def deleteNode(self, z, all=True):
+        """delete slot z, or one count of it if all is False"""
+        if not z:
+            return
+        if self.counts[z] > 1 and not all:
+            self.counts[z] -= 1
+            return
+
+        left, right, parent, color = \
+            self.left, self.right, self.parent, self.color
+
+        if not left[z] or not right[z]:
+            y = z
+        else:
+            # tree successor, which has no left child
+            y = right[z]
+            while left[y]:
+                y = left[y]
+
+        # x is y's only child
+        if left[y]:
+            x = left[y]
+        else:
+            x = right[y]
+
+        # remove y from the parent chain
+        p = parent[y]
+        parent[x] = p
+        if p:
+            if y == left[p]:
+                left[p] = x
+            else:
+                right[p] = x
+        else:
+            self.root = x
+
+        yColor = color[y]
+        if y != z:
+            # move y into z's place, see RBTree.deleteNode()
+            if parent[x] == z:
+                parent[x] = y
+            left[y] = left[z]
+            right[y] = right[z]
+            parent[y] = parent[z]
+            color[y] = color[z]
+            p = parent[z]
+            if p:
+                if z == left[p]:
+                    left[p] = y
+                else:
+                    right[p] = y
+            else:
+                self.root = y
+            if left[y]:
+                parent[left[y]] = y
+            if right[y]:
+                parent[right[y]] = y
+
+        self.updatePath(parent[x])
+
+        if yColor == BLACK:
+            self.deleteFixup(x)
+
+        self.release(z)
+        self.elements = self.elements - 1
+
+    def findNode(self, key):
+        """return the slot holding key, or 0"""
+        hash(key)
+        cmpfn, keys, left, right = self.__cmp, self.key, self.left, self.right
+        current = self.root
+        while current:
+            rc = cmpfn(key, keys[current])
+            if rc == 0:
+                return current
+            if rc < 0:
+                current = left[current]
+            else:
+                current = right[current]
+        return 0
+
+    def select(self, k):
+        """return the slot at in-order position k (0 based)"""
+        if (k < 0) or (k >= self.elements):
+            raise IndexError ("select index out of range")
+        left, right, size = self.left, self.right, self.size
+        cur = self.root
+        while 1:
+            before = size[left[cur]]
+            if k < before:
+                cur = left[cur]
+            elif k == before:
+                return cur
+            else:
+                k -= before + 1
+                cur = right[cur]
+
+    def rank(self, key):
+        """return the number of nodes whose key is less than key"""
+        hash(key)
+        cmpfn, keys, left, right, size = \
+            self.__cmp, self.key, self.left, self.right, self.size
+        cur = self.root
+        result = 0
+        while cur:
+            if cmpfn(key, keys[cur]) <= 0:
+                cur = left[cur]
+            else:
+                result += size[left[cur]] + 1
+                cur = right[cur]
+        return result
+
+    def firstNode(self):
+        left = self.left
+        cur = self.root
+        while left[cur]:
+            cur = left[cur]
+        return cur
+
+    def lastNode(self):
+        right = self.right
+        cur = self.root
+        while right[cur]:
+            cur = right[cur]
+        return cur
+
+    def nextNode(self, x):
+        """returns 0 if there isn't one"""
+        left, right, parent = self.left, self.right, self.parent
+        if right[x]:
+            x = right[x]
+            while left[x]:
+                x = left[x]
+            return x
+        p = parent[x]
+        while p and x == right[p]:
+            x = p
+            p = parent[p]
+        return p
+
+    def prevNode(self, x):
+        """returns 0 if there isn't one"""
+        left, right, parent = self.left, self.right, self.parent
+        if left[x]:
+            x = left[x]
+            while right[x]:
+                x = right[x]
+            return x
+        p = parent[x]
+        while p and x == left[p]:
+            x = p
+            p = parent[p]
+        return p
+
+    def nodes(self):
+        """return all slots as a list, in key order"""
+        result = []
+        cur = self.firstNode()
+        while cur:
+            result.append(cur)
+            cur = self.nextNode(cur)
+        return result
+
+    def sortPairs(self, pairs):
+        """see RBTree.sortPairs()"""
+        pairs = list(pairs)
+        for i in xrange(1, len(pairs)):
+            if self.__cmp(pairs[i-1][0], pairs[i][0]) > 0:
+                pairs.sort(cmp=self.__cmp, key=itemgetter(0))
+                break
+        return pairs
+
+    def loadSorted(self, pairs):
+        """fill an empty tree from (key, value) pairs given in ascending
+           key order in O(n), see RBTree.loadSorted()"""
+        if self.root:
+            raise ValueError ("loadSorted needs an empty tree")
+        self.clear()
+
+        keys, counts = self.key, self.counts
+        n = 0
+        for key, value in pairs:
+            hash(key)
+            if n:
+                rc = self.__cmp(key, keys[n])
+                if rc < 0:
+                    self.clear()
+                    raise ValueError ("loadSorted: keys are not sorted")
+                if rc == 0:
+                    if self.unique == False:
+                        counts[n] += 1
+                    else:
+                        print "Warning: This element is already in the list ... ignored!"
+                    continue
+            n = self.allocate(key, value, 0)
+        if not n:
+            return
+
+        # slots 1..n hold the keys in order; all black except the
+        # deepest level
+        self.color = array('b', [BLACK]) * (n + 1)
+        self.root = self.linkSorted(1, n + 1, 0, n.bit_length() - 1, 0)
+        self.elements = n
+
+    def linkSorted(self, lo, hi, depth, deepest, parent):
+        """link slots lo..hi-1 into a subtree below parent, return its root"""
+        if lo >= hi:
+            return 0
+        mid = (lo + hi) // 2
+        self.parent[mid] = parent
+        if depth == deepest and depth:
+            self.color[mid] = RED
+        self.left[mid] = self.linkSorted(lo, mid, depth + 1, deepest, mid)
+        self.right[mid] = self.linkSorted(mid + 1, hi, depth + 1, deepest, mid)
+        self.updateNode(mid)
+        return mid
+
+    @classmethod
+    def from_sorted(cls, pairs, cmpfn=cmp, unique=True):
+        """build a tree from (key, value) pairs in ascending key order"""
+        tree = cls(cmpfn, unique)
+        tree.loadSorted(pairs)
+        return tree
+
+
+class ArenaRBList(ArenaRBTree):
+    """ Drop in replacement for RBList, see there.
+        Keys and values are the same objects, so one column holds both.
+    """
+
+    def __init__(self, list=[], cmpfn=cmp, unique=True):
+        ArenaRBTree.__init__(self, cmpfn, unique)
+        self.loadSorted (self.sortPairs ([(item, item) for item in list]))
+
+    @classmethod
+    def from_sorted(cls, list, cmpfn=cmp, unique=True):
+        """build a list from items in ascending order in O(n)"""
+        rbList = cls ([], cmpfn, unique)
+        rbList.loadSorted ([(item, item) for item in list])
+        return rbList
+
+    def valueColumn(self):
+        return self.key
+
+    def __getitem__ (self, index):
+        return self.value[self.findNodeByIndex (index)]
+
+    def __delitem__ (self, index):
+        self.deleteNode (self.findNodeByIndex (index))
+
+    def __contains__ (self, item):
+        return self.findNode (item) != 0
+
+    def __str__ (self):
+        # eval(str(self)) returns a regular list
+        return '['+ string.join(map(str, self.values()), ', ')+']'
+
+    def findNodeByIndex (self, index):
+        if (index < 0) or (index >= self.elements):
+            raise IndexError ("pop index out of range")
+        return self.select (index)
+
+    def insert (self, item):
+        self.insertNode (item, item)
+
+    def append (self, item):
+        # list is always sorted
+        self.insert (item)
+
+    def count (self, item):
+        return self.counts[self.findNode (item)]
+
+    def index (self, item):
+        if not self.findNode (item):
+            raise ValueError ("ArenaRBList.index: item not in list")
+        return self.rank (item)
+
+    def extend (self, otherList):
+        for item in otherList:
+            self.insert (item)
+
+    def pop (self, index=None):
+        if index is None:
+            index = self.elements - 1
+        #
+        node = self.findNodeByIndex (index)
+        value = self.value[node]    # must do this before removing node
+        self.deleteNode (node)
+        return value
+
+    def remove (self, item, all=True):
+        node = self.findNode (item)
+        if node:
+            self.deleteNode (node, all)
+
+    def reverse (self): # not implemented
+        raise AssertionError ("ArenaRBList.reverse Not implemented")
+
+    def sort (self): # Null operation
+        pass
+
+    def values (self):
+        value = self.value
+        return [value[x] for x in self.nodes()]
+
+    def reverseValues (self):
+        values = self.values()
+        values.reverse()
+        return values
+
+
+class ArenaRBDict(ArenaRBTree):
+    """ Drop in replacement for RBDict, see there. """
+
+    def __init__(self, dict={}, cmpfn=cmp):
+        ArenaRBTree.__init__(self, cmpfn)
+        self.loadSorted(self.sortPairs(dict.items()))
+
+    @classmethod
+    def from_sorted(cls, pairs, cmpfn=cmp):
+        """build a dictionary from (key, value) pairs in ascending key
+           order in O(n)"""
+        rbDict = cls({}, cmpfn)
+        rbDict.loadSorted(pairs)
+        return rbDict
+
+    def __str__(self):
+        # eval(str(self)) returns a regular dictionary
+        return '{'+ string.join(map(lambda (k, v): repr(k) + ': ' + repr(v),
+                                    self.items()), ', ')+'}'
+
+    def __repr__(self):
+        return "<ArenaRBDict object " + str(self) + ">"
+
+    def __getitem__(self, key):
+        n = self.findNode(key)
+        if n:
+            return self.value[n]
+        raise IndexError
+
+    def __setitem__(self, key, value):
+        n = self.findNode(key)
+        if n:
+            self.value[n] = value
+        else:
+            self.insertNode(key, value)
+
+    def __delitem__(self, key):
+        n = self.findNode(key)
+        if n:
+            self.deleteNode(n)
+        else:
+            raise IndexError
+
+    def get(self, key, default=None):
+        n = self.findNode(key)
+        if n:
+            return self.value[n]
+        return default
+
+    def keys(self):
+        key = self.key
+        return [key[x] for x in self.nodes()]
+
+    def values(self):
+        value = self.value
+        return [value[x] for x in self.nodes()]
+
+    def items(self):
+        key, value = self.key, self.value
+        return [(key[x], value[x]) for x in self.nodes()]
+
+    def has_key(self, key):
+        return self.findNode(key) != 0
+
+    def copy(self):
+        """return shallow copy"""
+        return ArenaRBDict(self)
+
+    def update(self, other):
+        """Add all items from the supplied mapping to this one.
+
+        Will overwrite old entries with new ones.
+
+        """
+        for key in other.keys():
+            self[key] = other[key]
+
+    def setdefault(self, key, value=None):
+        if self.has_key(key):
+            return self[key]
+        self[key] = value
+        return value
+
+
+""" ----------------------------------------------------------------------------
+    TEST ROUTINES
+"""
+def checkTree(tree):
+    """assert the red-black properties and the sizes of tree,
+       returns the black height"""
+    left, right, parent, color, size = \
+        tree.left, tree.right, tree.parent, tree.color, tree.size
+    def check(x):
+        if not x:
+            return 1
+        if color[x] == RED:
+            assert color[left[x]] == BLACK and color[right[x]] == BLACK
+        for child in (left[x], right[x]):
+            if child:
+                assert parent[child] == x
+        assert size[x] == size[left[x]] + size[right[x]] + 1
+        height = check(left[x])
+        assert height == check(right[x])
+        return height + (color[x] == BLACK)
+    assert color[tree.root] == BLACK
+    assert size[tree.root] == len(tree)
+    return check(tree.root)
+
+def testArena():
+    import random
+    from RBTree import RBList, RBDict
+    print "--- Testing ArenaRBList / ArenaRBDict ---"
+
+    for unique in (True, False):
+        arena = ArenaRBList (unique=unique)
+        rbList = RBList (unique=unique)
+        for i in range(3000):
+            item = random.randrange(500)
+            if random.random() < 0.6:
+                if not unique or item not in rbList:
+                    arena.insert (item)
+                    rbList.insert (item)
+            else:
+                arena.remove (item, False)
+                rbList.remove (item, False)
+            if i % 100 == 0:
+                checkTree (arena)
+        assert arena.values() == rbList.values()
+        assert list(arena) == rbList.values()
+        for item in rbList.values():
+            assert arena.count (item) == rbList.count (item)
+            assert arena.index (item) == rbList.index (item)
+        while len(rbList):
+            i = random.randrange(len(rbList))
+            assert arena.pop (i) == rbList.pop (i)
+        checkTree (arena)
+    print "    lists match"
+
+    items = range(1000)
+    assert ArenaRBList.from_sorted (items).values() == items
+    random.shuffle(items)
+    arena = ArenaRBList (items)
+    assert arena.values() == sorted(items)
+    checkTree (arena)
+
+    pairs = [(random.randrange(1000), i) for i in range(500)]
+    arena = ArenaRBDict (dict(pairs))
+    rbDict = RBDict (dict(pairs))
+    assert arena.items() == rbDict.items()
+    for key in dict(pairs[:100]):
+        del arena[key]
+        del rbDict[key]
+    arena.update ({-1: 'a', 2000: 'b'})
+    rbDict.update ({-1: 'a', 2000: 'b'})
+    assert arena.items() == rbDict.items()
+    assert eval(str(arena)) == eval(str(rbDict))
+    assert arena.copy().items() == arena.items()
+    checkTree (arena)
+    print "    dictionaries match"
+    print
+
+
+if __name__ == "__main__":
+    testArena()
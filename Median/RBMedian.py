@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+#
+# Running median on top of RBTree, following the center cursor idea
+# of the drivers in main.py: instead of searching for the median after
+# every operation, a cursor is kept on the lower median and moved at
+# most one step per add or remove.
+#
+# The tree is not unique, so equal values share a node and are counted
+# in node.count.  The cursor therefore is a (node, offset) pair, with
+# offset running over the copies held by that node.
+#
+# WindowMedian reports the median of the last K values only, evicting
+# the oldest value on every push.  ExpiringMedian drops values once they
+# are older than a time horizon.
+
+from collections import deque
+from heapq import heappush, heappop
+
+from RBTree import RBTree
+
+
+class RBMedian(object):
+
+    def __init__(self):
+        self.tree = RBTree(unique=False)
+        self.center = None
+        self.offset = 0
+        self.size = 0
+
+    @classmethod
+    def fromTree(cls, tree):
+        """return a tracker taking over tree, a non unique RBTree such as
+           one loaded from a snapshot"""
+        tracker = cls()
+        tracker.tree = tree
+        tracker.size = tree.root.total
+        if tracker.size:
+            tracker.center, tracker.offset = tree.kthNode((tracker.size - 1) // 2)
+        return tracker
+
+    def __len__(self):
+        return self.size
+
+    def stepForward(self):
+        if self.offset + 1 < self.center.count:
+            self.offset += 1
+        else:
+            self.center = self.tree.nextNode(self.center)
+            self.offset = 0
+
+    def stepBackward(self):
+        if self.offset:
+            self.offset -= 1
+        else:
+            self.center = self.tree.prevNode(self.center)
+            self.offset = self.center.count - 1
+
+    def add(self, e):
+        """add e and return the node holding it"""
+        node = self.tree.insertNode(e, None)
+        self.size += 1
+        if self.size == 1:
+            self.center = node
+            self.offset = 0
+            return node
+
+        # an equal value is counted in the center node after the cursor,
+        # so it is on the center's right as well
+        if e >= self.center.key: #case 1, the element is added to center's right
+            if self.size % 2:
+                #become odd, center is 1 step forward
+                self.stepForward()
+        else: #case 2, the element is added to center's left
+            if not self.size % 2:
+                #become even, center is 1 step backward
+                self.stepBackward()
+        return node
+
+    def remove(self, e):
+        if not self.size:
+            raise ValueError
+        if e == self.center.key:
+            node = self.center
+        else:
+            node = self.tree.findNode(e)
+            if node is None:
+                raise ValueError #cannot find the node to delete
+        self.removeNode(node)
+
+    def removeNode(self, node):
+        """remove one copy of the value held by node"""
+        self.size -= 1
+        if node is self.center: #case 0, remove the copy under the cursor
+            center, offset = self.center, self.offset
+            if not self.size:
+                self.center = None
+            elif self.size % 2 == 0:
+                self.stepBackward()
+            elif offset + 1 == center.count:
+                self.center = self.tree.nextNode(center)
+                self.offset = 0
+            # else the next copy slides into the cursor's offset
+            self.tree.deleteNode(center, False)
+            return
+
+        e = node.key
+        self.tree.deleteNode(node, False)
+        if e > self.center.key: #case 1, the element removed is right to center
+            if self.size % 2 == 0:
+                #become even, center is 1 step backward
+                self.stepBackward()
+        else: #case 2, the element removed is left to center
+            if self.size % 2:
+                #become odd, center is 1 step forward
+                self.stepForward()
+
+    def median(self):
+        if not self.size:
+            raise ValueError
+        if self.size % 2:
+            return self.center.key
+        if self.offset + 1 < self.center.count:
+            return self.center.key
+        return (self.center.key + self.tree.nextNode(self.center).key) / 2.0
+
+    def kth(self, k):
+        return self.tree.kth(k)
+
+    def quantile(self, q, interpolation='linear'):
+        return self.tree.quantile(q, interpolation)
+
+
+class WindowMedian(RBMedian):
+    """ Median of the last `window` values pushed.
+
+        The node of every value in the window is queued, so evicting
+        the oldest value needs no search of the tree.
+    """
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("window must hold at least one value")
+        RBMedian.__init__(self)
+        self.window = window
+        self.queue = deque()
+
+    def push(self, e):
+        """add e, evict the oldest value if the window is full and
+           return the median of the window"""
+        self.queue.append(self.add(e))
+        if self.size > self.window:
+            self.removeNode(self.queue.popleft())
+        return self.median()
+
+
+class ExpiringMedian(RBMedian):
+    """ Median of the values added during the last `horizon` time units.
+
+        Every add is stamped, and the nodes are queued in a heap by
+        expiry time, so ageing a value out needs no search of the tree.
+        The clock is the latest timestamp seen by add() or expire(), so
+        timestamps may arrive slightly out of order.
+    """
+
+    def __init__(self, horizon):
+        RBMedian.__init__(self)
+        self.horizon = horizon
+        self.now = None
+        self.queue = []
+        self.seq = 0
+        # value -> heap of the (expiry, seq) entries queued for it
+        self.pending = {}
+        # seq of the entries whose copy was already removed by hand
+        self.cancelled = set()
+
+    def add(self, e, timestamp):
+        """add e seen at timestamp, then expire everything too old"""
+        self.seq += 1
+        node = RBMedian.add(self, e)
+        entry = (timestamp + self.horizon, self.seq)
+        heappush(self.queue, entry + (node,))
+        heappush(self.pending.setdefault(e, []), entry)
+        self.expire(timestamp)
+        return node
+
+    def remove(self, e):
+        RBMedian.remove(self, e)
+        # the removed copy is taken to be the one due to expire first,
+        # so its queue entry is skipped when it comes up
+        self.cancelled.add(self.popPending(e)[1])
+
+    def popPending(self, e):
+        pending = self.pending[e]
+        entry = heappop(pending)
+        if not pending:
+            del self.pending[e]
+        return entry
+
+    def expire(self, now):
+        """advance the clock to now and drop the values older than
+           the horizon"""
+        if self.now is None or now > self.now:
+            self.now = now
+        queue, cancelled = self.queue, self.cancelled
+        while queue and queue[0][0] < self.now:
+            expiry, seq, node = heappop(queue)
+            if seq in cancelled:
+                cancelled.remove(seq)
+                continue
+            # a node lives as long as some copy of its value is queued
+            # and not cancelled, so node is still in the tree; its entry
+            # is also the first one pending for the value
+            self.popPending(node.key)
+            self.removeNode(node)
+
+    def median(self, now=None):
+        if now is not None:
+            self.expire(now)
+        return RBMedian.median(self)
+
+
+def benchmark(n=200000, window=1000, spread=1000):
+    """compare WindowMedian with feeding the evictions by hand"""
+    import random
+    import time
+
+    values = [random.randrange(spread) for i in xrange(n)]
+
+    start = time.time()
+    tracker = WindowMedian(window)
+    for e in values:
+        tracker.push(e)
+    windowed = time.time() - start
+
+    start = time.time()
+    tracker = RBMedian()
+    for i, e in enumerate(values):
+        tracker.add(e)
+        if i >= window:
+            tracker.remove(values[i - window])
+        tracker.median()
+    manual = time.time() - start
+
+    print "%d values, window %d" % (n, window)
+    print "    WindowMedian.push:      %.3fs" % windowed
+    print "    add + remove by value:  %.3fs" % manual
+
+
+def testRBMedian():
+    import random
+    print "--- Testing RBMedian ---"
+
+    def median(values):
+        """median of values by sorting, None if there are none"""
+        values = sorted(values)
+        n = len(values)
+        if not n:
+            return None
+        if n % 2:
+            return values[n // 2]
+        return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+    def tracked(tracker):
+        try:
+            return tracker.median()
+        except ValueError:
+            return None
+
+    print "    Add and remove tests..."
+    tracker = RBMedian()
+    values = []
+    for i in range(3000):
+        e = random.randrange(30)
+        if random.random() < 0.55:
+            tracker.add(e)
+            values.append(e)
+        elif e in values:
+            tracker.remove(e)
+            values.remove(e)
+        else:
+            try:
+                tracker.remove(e)
+                assert False
+            except ValueError:
+                pass
+        assert len(tracker) == len(values)
+        assert tracked(tracker) == median(values)
+
+    print "    Window tests..."
+    for window in (1, 2, 5, 16):
+        tracker = WindowMedian(window)
+        values = []
+        for i in range(500):
+            e = random.randrange(20)
+            values.append(e)
+            assert tracker.push(e) == median(values[-window:])
+
+    print "    Expiry tests..."
+
+    class Model(object):
+        """brute force ExpiringMedian: a list of [expiry, seq, value]"""
+
+        def __init__(self, horizon):
+            self.horizon = horizon
+            self.now = None
+            self.held = []
+            self.seq = 0
+
+        def add(self, e, timestamp):
+            self.seq += 1
+            self.held.append([timestamp + self.horizon, self.seq, e])
+            self.expire(timestamp)
+
+        def remove(self, e):
+            # the copy of e due to expire first
+            copies = [entry for entry in self.held if entry[2] == e]
+            if not copies:
+                raise ValueError
+            self.held.remove(min(copies))
+
+        def expire(self, now):
+            if self.now is None or now > self.now:
+                self.now = now
+            self.held = [entry for entry in self.held if entry[0] >= self.now]
+
+        def median(self, now=None):
+            if now is not None:
+                self.expire(now)
+            return median([entry[2] for entry in self.held])
+
+    # a copy removed by hand, then an earlier stamped copy of the value
+    tracker, model = ExpiringMedian(10), Model(10)
+    for op in (('add', 5, 100), ('add', 1, 100), ('remove', 5),
+               ('add', 5, 95), ('add', 5, 102), ('remove', 5),
+               ('expire', 104), ('expire', 106), ('expire', 113)):
+        for t in (tracker, model):
+            getattr(t, op[0])(*op[1:])
+        assert tracked(tracker) == model.median()
+
+    for horizon in (1, 5, 20):
+        tracker, model = ExpiringMedian(horizon), Model(horizon)
+        clock = 0
+        for i in range(2000):
+            clock += random.randrange(3)
+            r = random.random()
+            if r < 0.5:
+                # stamps may be a little late
+                stamp = clock - random.randrange(4)
+                e = random.randrange(10)
+                tracker.add(e, stamp)
+                model.add(e, stamp)
+            elif r < 0.8:
+                e = random.randrange(10)
+                try:
+                    model.remove(e)
+                except ValueError:
+                    try:
+                        tracker.remove(e)
+                        assert False
+                    except ValueError:
+                        pass
+                else:
+                    tracker.remove(e)
+            else:
+                tracker.expire(clock)
+                model.expire(clock)
+            assert len(tracker) == len(model.held)
+            assert tracked(tracker) == model.median()
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(*map(int, sys.argv[2:]))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testRBMedian()
+        sys.exit(0)
+
+    N = int(raw_input())
+
+    tracker = RBMedian()
+    for i in range(0, N):
+        a, b = raw_input().split(' ')
+        try:
+            if a == 'a':
+                tracker.add(int(b))
+            else:
+                tracker.remove(int(b))
+            m = tracker.median()
+            if m == int(m):
+                print str(int(m))
+            else:
+                print m
+        except ValueError:
+            print "Wrong!"
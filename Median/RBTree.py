@@ -39,13 +39,65 @@
 
 __version__ = "1.6"
 
+import gc
+import marshal
+import mmap
 import string
+import struct
+from array import array
+from itertools import izip
+from operator import itemgetter
 
 BLACK = 0
 RED = 1
 
+QUANTILE_MODES = ('lower', 'higher', 'nearest', 'midpoint', 'linear')
+
+# cost of one step of an insert in steps of a merge, for RBDict.update
+MERGE_STEPS = 2
+
+# Snapshot files (see RBTree.save) start with a header
+#
+#   magic, flags, number of nodes
+#
+# followed by up to three columns, keys, values and counts, in key
+# order.  Each column is a (type, byte length) pair and the data: an
+# array of C longs ('l') or doubles ('d') in native layout, or a
+# marshalled list ('m') for any other keys or values.  RBList values
+# are not stored, they are the keys; counts are only stored if some
+# key was inserted more than once.  The flags say which columns are
+# there, and whether the tree is unique and keeps value aggregates.
+SNAPSHOT_MAGIC = 'RBTSNAP1'
+SNAPSHOT_HEADER = '<8sBQ'
+SNAPSHOT_COLUMN = '<cQ'
+SNAPSHOT_UNIQUE = 1
+SNAPSHOT_VALUES = 2
+SNAPSHOT_COUNTS = 4
+SNAPSHOT_AGGREGATE = 8
+
+def packColumn(items):
+    """return (type, bytes) for a snapshot column holding items"""
+    if all(type(x) is int for x in items):
+        return 'l', array('l', items).tostring()
+    if all(type(x) is float for x in items):
+        return 'd', array('d', items).tostring()
+    return 'm', marshal.dumps(items)
+
+def unpackColumn(kind, data):
+    """return the items of a snapshot column as a list"""
+    if kind == 'm':
+        return marshal.loads(data)
+    column = array(kind)
+    column.fromstring(data)
+    return column.tolist()
+
 class RBNode(object):
 
+    # sum, least and greatest value in the subtree rooted here, only
+    # kept in trees built with aggregate=True (see RBTree.updateNode)
+    sum = 0
+    low = high = None
+
     def __init__(self, key = None, value = None, color = RED):
         self.left = self.right = self.parent = None
         self.color = color
@@ -53,6 +105,12 @@ class RBNode(object):
         self.value = value
         self.nonzero = 1
         self.count = 1
+        # number of nodes in the subtree rooted here
+        self.size = 1
+        # sum of the counts in the subtree rooted here
+        self.total = 1
+        # in-order neighbours, None at either end
+        self.next = self.prev = None
 
     def __str__(self):
         return repr(self.key) + ': ' + repr(self.value)
@@ -75,41 +133,49 @@ class RBNode(object):
 
 class RBTreeIter(object):
 
-    def __init__ (self, tree):
+    def __init__ (self, tree, reverse=False):
         self.tree = tree
-        self.index = -1  # ready to iterate on the next() call
-        self.node = None
+        self.reverse = reverse
+        self.node = None  # ready to iterate on the next() call
         self.stopped = False
 
     def __iter__ (self):
-        """ Return the current item in the container
-        """
-        return self.node.value
+        return self
 
     def next (self):
         """ Return the next item in the container
             Once we go off the list we stay off even if the list changes
         """
-        if self.stopped or (self.index + 1 >= self.tree.__len__()):
-            self.stopped = True
+        if self.stopped:
             raise StopIteration
-        #
-        self.index += 1
-        if self.index == 0:
-            self.node = self.tree.firstNode()
+        # follow the threads, O(1) a step
+        if self.node is None:
+            if self.reverse:
+                node = self.tree.tail
+            else:
+                node = self.tree.head
+        elif self.reverse:
+            node = self.node.prev
         else:
-            self.node = self.tree.nextNode (self.node)
-        return self.node.value
+            node = self.node.next
+        if node is None:
+            self.stopped = True
+            raise StopIteration
+        self.node = node
+        return node.value
 
 
 class RBTree(object):
 
-    def __init__(self, cmpfn=cmp, unique=True):
+    def __init__(self, cmpfn=cmp, unique=True, aggregate=False):
         self.sentinel = RBNode()
         self.sentinel.left = self.sentinel.right = self.sentinel
         self.sentinel.color = BLACK
         self.sentinel.nonzero = 0
+        self.sentinel.size = 0
+        self.sentinel.total = 0
         self.root = self.sentinel
+        self.head = self.tail = None
         self.elements = 0
         
         #SF: If self.unique is True, all elements in the tree have 
@@ -119,6 +185,9 @@ class RBTree(object):
        	#SF times. There is still only one node, but all insertions are
        	#SF counted in the variable node.count
         self.unique = unique
+        # keep the sum, minimum and maximum of the values of every
+        # subtree; the values have to be numbers then
+        self.aggregate = aggregate
         # changing the comparison function for an existing tree is dangerous!
         self.__cmp = cmpfn
 
@@ -132,16 +201,17 @@ class RBTree(object):
 
         if self.root is not self.sentinel:
             while s:
-                cur = s[0]
+                cur = s.pop()
                 if cur.left and cur.left != self.sentinel:
                     s.append(cur.left)
                 if cur.right and cur.right != self.sentinel:
                     s.append(cur.right)
                 cur.right = cur.left = cur.parent = None
+                cur.next = cur.prev = None
                 cur.key = cur.value = None
-                s = s[1:]
 
         self.root = None
+        self.head = self.tail = None
         self.sentinel = None
 
     def __str__(self):
@@ -153,6 +223,34 @@ class RBTree(object):
     def __iter__ (self):
         return RBTreeIter (self)
 
+    def __reversed__ (self):
+        return RBTreeIter (self, True)
+
+    def updateNode(self, x):
+        """recompute the subtree size and total of x from its children,
+           and the value aggregates if the tree keeps them"""
+        left, right = x.left, x.right
+        x.size = left.size + right.size + 1
+        x.total = left.total + right.total + x.count
+        if self.aggregate:
+            value = x.value
+            x.sum = left.sum + right.sum + value * x.count
+            low = high = value
+            if left.size:
+                low = min(low, left.low)
+                high = max(high, left.high)
+            if right.size:
+                low = min(low, right.low)
+                high = max(high, right.high)
+            x.low, x.high = low, high
+
+    def updatePath(self, x):
+        """recompute the subtree sizes and totals from x up to the
+           root"""
+        while x:
+            self.updateNode(x)
+            x = x.parent
+
     def rotateLeft(self, x):
 
         y = x.right
@@ -178,6 +276,10 @@ class RBTree(object):
         if x != self.sentinel:
             x.parent = y
 
+        # x is now below y, so fix its size first
+        self.updateNode(x)
+        self.updateNode(y)
+
     def rotateRight(self, x):
 
         #***************************
@@ -207,6 +309,10 @@ class RBTree(object):
         if x != self.sentinel:
             x.parent = y
 
+        # x is now below y, so fix its size first
+        self.updateNode(x)
+        self.updateNode(y)
+
     def insertFixup(self, x):
         #************************************
         #  maintain Red-Black tree balance  *
@@ -264,7 +370,11 @@ class RBTree(object):
                     x.parent.parent.color = RED
                     self.rotateLeft(x.parent.parent)
 
+        # a red root can only come from recoloring, and blackening it
+        # adds one to the black height of the tree (see joinRoots)
+        grew = self.root.color == RED
         self.root.color = BLACK
+        return grew
 
     def insertNode(self, key, value):
         #**********************************************
@@ -289,6 +399,7 @@ class RBTree(object):
                 #SF the count
                 if self.unique == False: 
                     current.count += 1
+                    self.updatePath(current)
                 else: # raise an Error
                     print "Warning: This element is already in the list ... ignored!"
                     #SF I don't want to raise an error because I want to keep 
@@ -309,14 +420,31 @@ class RBTree(object):
 
         self.elements = self.elements + 1
 
-        # insert node in tree
+        # insert node in tree, and between its in-order neighbours,
+        # one of which is the parent
         if parent:
-            if self.__cmp(key, parent.key) < 0:
+            if rc < 0:
                 parent.left = x
+                x.next = parent
+                x.prev = parent.prev
             else:
                 parent.right = x
+                x.prev = parent
+                x.next = parent.next
         else:
             self.root = x
+        if x.prev:
+            x.prev.next = x
+        else:
+            self.head = x
+        if x.next:
+            x.next.prev = x
+        else:
+            self.tail = x
+
+        # every ancestor of x has gained one node; x itself needs its
+        # value aggregates
+        self.updatePath(x)
 
         self.insertFixup(x)
         return x
@@ -395,6 +523,7 @@ class RBTree(object):
         #SF If all=True then the complete node has to be deleted
         if z.count > 1 and not all: 
             z.count -= 1
+            self.updatePath(z)
             return          
 
         if z.left == self.sentinel or z.right == self.sentinel:
@@ -422,14 +551,48 @@ class RBTree(object):
         else:
             self.root = x
 
+        color = y.color
         if y != z:
-            z.key = y.key
-            z.value = y.value
-
-        if y.color == BLACK:
+            # move y into z's place instead of copying its key, value
+            # and count across, so that references to y held by
+            # callers (e.g. a median cursor) stay valid
+            if x.parent == z:
+                x.parent = y
+            y.left = z.left
+            y.right = z.right
+            y.parent = z.parent
+            y.color = z.color
+            if z.parent:
+                if z == z.parent.left:
+                    z.parent.left = y
+                else:
+                    z.parent.right = y
+            else:
+                self.root = y
+            if y.left != self.sentinel:
+                y.left.parent = y
+            if y.right != self.sentinel:
+                y.right.parent = y
+
+        # every ancestor of x has lost one node; this has to be
+        # done before the fixup rotations, which rely on the
+        # sizes of their children
+        self.updatePath(x.parent)
+
+        if color == BLACK:
             self.deleteFixup(x)
 
-        del y
+        if z.prev:
+            z.prev.next = z.next
+        else:
+            self.head = z.next
+        if z.next:
+            z.next.prev = z.prev
+        else:
+            self.tail = z.prev
+
+        z.left = z.right = z.parent = None
+        z.next = z.prev = None
         self.elements = self.elements - 1
 
     def findNode(self, key):
@@ -458,6 +621,732 @@ class RBTree(object):
 
         return None
 
+    def boundNode(self, key, strict):
+        """return the first node whose key is greater or equal to key,
+           or greater if strict; None if there is none"""
+        hash(key)
+        cur = self.root
+        result = None
+        while cur != self.sentinel:
+            rc = self.__cmp(key, cur.key)
+            if rc < 0 or rc == 0 and not strict:
+                result = cur
+                cur = cur.left
+            else:
+                cur = cur.right
+        return result
+
+    def lower_bound(self, key):
+        """return the first node with key >= key, or None"""
+        return self.boundNode(key, False)
+
+    def upper_bound(self, key):
+        """return the first node with key > key, or None"""
+        return self.boundNode(key, True)
+
+    def ceiling(self, key):
+        """return the node with the least key >= key, or None"""
+        return self.boundNode(key, False)
+
+    def floor(self, key):
+        """return the node with the greatest key <= key, or None"""
+        x = self.boundNode(key, True)
+        if x is None:
+            return self.tail
+        return x.prev
+
+    def irange(self, lo=None, hi=None, reverse=False):
+        """generate the nodes with lo <= key < hi in ascending order, or
+           descending if reverse, without building a list; a bound of
+           None leaves that side open.  Finding the ends costs O(log n),
+           every node after that O(1) along the threads.  The tree must
+           not change while the generator runs."""
+        if lo is not None and hi is not None and self.__cmp(lo, hi) >= 0:
+            return
+        if lo is None:
+            first = self.head
+        else:
+            first = self.boundNode(lo, False)
+        if hi is None:
+            stop = None
+        else:
+            stop = self.boundNode(hi, False)
+        if reverse:
+            # walk from the node before stop back to the one before first
+            if stop is None:
+                x = self.tail
+            else:
+                x = stop.prev
+            if first is None:
+                return
+            stop = first.prev
+            while x is not stop:
+                yield x
+                x = x.prev
+        else:
+            x = first
+            while x is not stop:
+                yield x
+                x = x.next
+
+    def select(self, k):
+        """return the node at in-order position k (0 based)"""
+        if (k < 0) or (k >= self.elements):
+            raise IndexError ("select index out of range")
+        cur = self.root
+        while 1:
+            before = cur.left.size
+            if k < before:
+                cur = cur.left
+            elif k == before:
+                return cur
+            else:
+                k -= before + 1
+                cur = cur.right
+
+    def rank(self, key):
+        """return the number of nodes whose key is less than key"""
+        hash(key)
+        cur = self.root
+        result = 0
+        while cur != self.sentinel:
+            if self.__cmp(key, cur.key) <= 0:
+                cur = cur.left
+            else:
+                result += cur.left.size + 1
+                cur = cur.right
+        return result
+
+    def kthNode(self, k):
+        """return the node holding the k-th smallest key (0 based),
+           counting every key as often as it was inserted, and which
+           of its copies that is"""
+        if (k < 0) or (k >= self.root.total):
+            raise IndexError ("kth index out of range")
+        cur = self.root
+        while 1:
+            before = cur.left.total
+            if k < before:
+                cur = cur.left
+            elif k < before + cur.count:
+                return cur, k - before
+            else:
+                k -= before + cur.count
+                cur = cur.right
+
+    def kth(self, k):
+        """return the k-th smallest key (0 based), counting every key
+           as often as it was inserted"""
+        return self.kthNode(k)[0].key
+
+    def quantile(self, q, interpolation='linear'):
+        """return the q-quantile of the keys (0 <= q <= 1), counting
+           every key as often as it was inserted.  Between two keys the
+           result is chosen as in numpy.percentile: 'lower', 'higher',
+           'nearest', 'midpoint' (as the median) or 'linear'"""
+        n = self.root.total
+        if not n:
+            raise ValueError ("quantile of an empty tree")
+        if not (0 <= q <= 1):
+            raise ValueError ("quantile must be between 0 and 1")
+        if interpolation not in QUANTILE_MODES:
+            raise ValueError ("unknown interpolation %r" % interpolation)
+        pos = q * (n - 1)
+        i = int(pos)
+        frac = pos - i
+        low = self.kth(i)
+        if not frac or interpolation == 'lower':
+            return low
+        high = self.kth(i + 1)
+        if interpolation == 'higher' or low == high:
+            return high
+        if interpolation == 'nearest':
+            if frac > 0.5 or frac == 0.5 and i % 2:
+                return high
+            return low
+        if interpolation == 'midpoint':
+            return (low + high) / 2.0
+        return low + (high - low) * frac
+
+    def countBelow(self, key):
+        """return the number of keys less than key, counting repeats"""
+        hash(key)
+        cur = self.root
+        result = 0
+        while cur != self.sentinel:
+            if self.__cmp(key, cur.key) <= 0:
+                cur = cur.left
+            else:
+                result += cur.left.total + cur.count
+                cur = cur.right
+        return result
+
+    def count_range(self, lo, hi):
+        """return the number of keys with lo <= key < hi, counting
+           repeats, in O(log n)"""
+        return max(0, self.countBelow(hi) - self.countBelow(lo))
+
+    def sumBelow(self, key):
+        """return the sum of the values of the keys less than key"""
+        if not self.aggregate:
+            raise ValueError ("value aggregates need a tree built with aggregate=True")
+        cur = self.root
+        result = 0
+        while cur != self.sentinel:
+            if self.__cmp(key, cur.key) <= 0:
+                cur = cur.left
+            else:
+                result += cur.left.sum + cur.value * cur.count
+                cur = cur.right
+        return result
+
+    def sum_range(self, lo, hi):
+        """return the sum of the values of the keys with lo <= key < hi,
+           each counted as often as its key was inserted, in O(log n)"""
+        if self.__cmp(lo, hi) >= 0:
+            return 0
+        return self.sumBelow(hi) - self.sumBelow(lo)
+
+    def extremeRange(self, lo, hi, field, pick):
+        """return the value chosen by pick among the values of the keys
+           with lo <= key < hi, from the subtree aggregates named field"""
+        if not self.aggregate:
+            raise ValueError ("value aggregates need a tree built with aggregate=True")
+        cmpfn = self.__cmp
+        # the highest node in the range; the range is its own key, the
+        # keys >= lo in its left subtree and the keys < hi in its right
+        cur = self.root
+        while cur != self.sentinel:
+            if cmpfn(cur.key, lo) < 0:
+                cur = cur.right
+            elif cmpfn(cur.key, hi) >= 0:
+                cur = cur.left
+            else:
+                break
+        if cur == self.sentinel:
+            raise ValueError ("no keys in range")
+        result = cur.value
+        x = cur.left
+        while x != self.sentinel:
+            if cmpfn(x.key, lo) >= 0:
+                result = pick(result, x.value)
+                if x.right.size:
+                    result = pick(result, getattr(x.right, field))
+                x = x.left
+            else:
+                x = x.right
+        x = cur.right
+        while x != self.sentinel:
+            if cmpfn(x.key, hi) < 0:
+                result = pick(result, x.value)
+                if x.left.size:
+                    result = pick(result, getattr(x.left, field))
+                x = x.right
+            else:
+                x = x.left
+        return result
+
+    def min_range(self, lo, hi):
+        """return the least value of the keys with lo <= key < hi,
+           ValueError if there are none"""
+        return self.extremeRange(lo, hi, 'low', min)
+
+    def max_range(self, lo, hi):
+        """return the greatest value of the keys with lo <= key < hi,
+           ValueError if there are none"""
+        return self.extremeRange(lo, hi, 'high', max)
+
+    def sortPairs(self, pairs):
+        """return the (key, value) pairs as a list in ascending key
+           order; input that is already sorted is only checked"""
+        pairs = list(pairs)
+        for i in xrange(1, len(pairs)):
+            if self.__cmp(pairs[i-1][0], pairs[i][0]) > 0:
+                pairs.sort(cmp=self.__cmp, key=itemgetter(0))
+                break
+        return pairs
+
+    def loadSorted(self, pairs, replace=False):
+        """fill an empty tree from (key, value) pairs given in ascending
+           key order, in O(n) instead of one insertNode per pair; with
+           replace, a repeated key of a unique tree takes the later value
+           silently"""
+        if self.root != self.sentinel:
+            raise ValueError ("loadSorted needs an empty tree")
+
+        nodes = []
+        last = None
+        for key, value in pairs:
+            hash(key)
+            if last is not None:
+                rc = self.__cmp(key, last.key)
+                if rc < 0:
+                    raise ValueError ("loadSorted: keys are not sorted")
+                if rc == 0:
+                    # same handling of repeated keys as insertNode
+                    if self.unique == False:
+                        last.count += 1
+                    elif replace:
+                        last.value = value
+                    else:
+                        print "Warning: This element is already in the list ... ignored!"
+                    continue
+            last = RBNode(key, value, BLACK)
+            nodes.append(last)
+        self.linkNodes(nodes)
+
+    def linkNodes(self, nodes):
+        """make this empty tree from black nodes with distinct keys, given
+           in ascending order"""
+        if not nodes:
+            return
+        last = None
+        for node in nodes:
+            node.prev = last
+            if last is not None:
+                last.next = node
+            last = node
+        self.head = nodes[0]
+        self.tail = last
+
+        # Splitting at the middle keeps every path within one level of
+        # the others, so all levels but the deepest one are full.  All
+        # nodes are black except those on the deepest level, which are
+        # red; this gives every path the same black height.
+        deepest = len(nodes).bit_length() - 1
+        self.root = self.linkSorted(nodes, 0, len(nodes), 0, deepest, None)
+        self.elements = len(nodes)
+
+    def linkSorted(self, nodes, lo, hi, depth, deepest, parent):
+        """link nodes[lo:hi] into a subtree below parent, return its root"""
+        if lo >= hi:
+            return self.sentinel
+        mid = (lo + hi) // 2
+        x = nodes[mid]
+        x.parent = parent
+        if depth == deepest and depth:
+            x.color = RED
+        x.left = self.linkSorted(nodes, lo, mid, depth + 1, deepest, x)
+        x.right = self.linkSorted(nodes, mid + 1, hi, depth + 1, deepest, x)
+        self.updateNode(x)
+        return x
+
+    @classmethod
+    def from_sorted(cls, pairs, cmpfn=cmp, unique=True, aggregate=False):
+        """build a tree from (key, value) pairs in ascending key order"""
+        tree = cls(cmpfn, unique, aggregate)
+        tree.loadSorted(pairs)
+        return tree
+
+    def emptyTree(self):
+        """return an empty tree of the same class, comparison function
+           and uniqueness, sharing the sentinel of this tree"""
+        tree = object.__new__(self.__class__)
+        tree.sentinel = self.sentinel
+        tree.root = self.sentinel
+        tree.head = tree.tail = None
+        tree.elements = 0
+        tree.unique = self.unique
+        tree.aggregate = self.aggregate
+        tree.__cmp = self.__cmp
+        return tree
+
+    def cloneTree(self):
+        """return a copy of the tree with the same shape, colors, counts
+           and subtree fields, in O(n) without any comparisons; keys and
+           values are shared, not copied"""
+        tree = object.__new__(self.__class__)
+        RBTree.__init__(tree, self.__cmp, self.unique, self.aggregate)
+        if self.root == self.sentinel:
+            return tree
+        sentinel = tree.sentinel
+        aggregate = self.aggregate
+
+        def clone(x, parent):
+            c = RBNode(x.key, x.value, x.color)
+            c.count, c.size, c.total = x.count, x.size, x.total
+            if aggregate:
+                c.sum, c.low, c.high = x.sum, x.low, x.high
+            c.left = c.right = sentinel
+            c.parent = parent
+            return c
+
+        # in-order walk of both trees at once: a clone is made on the
+        # way down and linked into the thread list when it is visited.
+        # Nothing made here can be garbage, see load.
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            tree.root = dst = clone(self.root, None)
+            src = self.root
+            stack = []
+            last = None
+            while 1:
+                while src.left != self.sentinel:
+                    stack.append((src, dst))
+                    dst.left = clone(src.left, dst)
+                    src, dst = src.left, dst.left
+                while 1:
+                    dst.prev = last
+                    if last is None:
+                        tree.head = dst
+                    else:
+                        last.next = dst
+                    last = dst
+                    if src.right != self.sentinel:
+                        dst.right = clone(src.right, dst)
+                        src, dst = src.right, dst.right
+                        break
+                    if not stack:
+                        tree.tail = last
+                        tree.elements = self.elements
+                        return tree
+                    src, dst = stack.pop()
+        finally:
+            if collect:
+                gc.enable()
+
+    def sameOrder(self, other):
+        """true if other is a tree kept in the order of this one"""
+        return isinstance(other, RBTree) and other.__cmp is self.__cmp
+
+    def mergeSorted(self, pairs):
+        """merge (key, value) pairs given in ascending key order into the
+           tree in O(n + m) and rebuild it; a key already in the tree, or
+           repeated in pairs, gets the later value in a unique tree and
+           one more count otherwise"""
+        cmpfn = self.__cmp
+        unique = self.unique
+        nodes = []
+        append = nodes.append
+        x = self.head
+        last = None
+        # see load
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            for key, value in pairs:
+                rc = 1
+                while x is not None:
+                    rc = cmpfn(x.key, key)
+                    if rc >= 0:
+                        break
+                    append(x)
+                    last = x
+                    x = x.next
+                if rc == 0:
+                    append(x)
+                    last = x
+                    x = x.next
+                elif last is None or cmpfn(key, last.key) > 0:
+                    hash(key)
+                    last = RBNode(key, value, BLACK)
+                    append(last)
+                    continue
+                elif cmpfn(key, last.key):
+                    raise ValueError ("mergeSorted: keys are not sorted")
+                if unique:
+                    last.value = value
+                else:
+                    last.count += 1
+            while x is not None:
+                append(x)
+                x = x.next
+
+            # the nodes of the tree are reused as they are, only their
+            # links, colors and subtree fields are made again
+            for x in nodes:
+                x.color = BLACK
+            self.root = self.sentinel
+            self.head = self.tail = None
+            self.elements = 0
+            self.linkNodes(nodes)
+        finally:
+            if collect:
+                gc.enable()
+
+    def moveFrom(self, tree):
+        """take over all nodes of tree, which is left empty"""
+        self.sentinel = tree.sentinel
+        self.root = tree.root
+        self.head, self.tail = tree.head, tree.tail
+        self.elements = tree.elements
+        # tree must not unlink the nodes when it is deleted
+        tree.root = tree.sentinel
+        tree.head = tree.tail = None
+        tree.elements = 0
+
+    def blackHeight(self, x):
+        """number of black nodes on a path from x down to the sentinel,
+           both included"""
+        height = 1
+        while x != self.sentinel:
+            if x.color == BLACK:
+                height += 1
+            x = x.left
+        return height
+
+    def joinRoots(self, a, ha, x, b, hb):
+        """link the detached subtrees a and b, of black heights ha and
+           hb, with x in between; all keys of a are less than x's, all
+           keys of b greater.  Returns the new root and its black height.
+
+           x goes in red, as deep as it can on the right spine of the
+           higher subtree (the left spine if that is b) where the lower
+           one fits as its other child, and insertFixup restores the
+           red-black properties.  The cost is O(|ha - hb| + 1)."""
+        sentinel = self.sentinel
+        if a.color == RED:
+            a.color = BLACK
+            ha += 1
+        if b.color == RED:
+            b.color = BLACK
+            hb += 1
+        x.color = RED
+        parent = None
+        if ha >= hb:
+            cur, height = a, ha
+            while cur.color == RED or height > hb:
+                if cur.color == BLACK:
+                    height -= 1
+                parent = cur
+                cur = cur.right
+            x.left, x.right = cur, b
+            if parent:
+                parent.right = x
+        else:
+            cur, height = b, hb
+            while cur.color == RED or height > ha:
+                if cur.color == BLACK:
+                    height -= 1
+                parent = cur
+                cur = cur.left
+            x.left, x.right = a, cur
+            if parent:
+                parent.left = x
+        x.parent = parent
+        if x.left != sentinel:
+            x.left.parent = x
+        if x.right != sentinel:
+            x.right.parent = x
+
+        if parent:
+            self.root = (a, b)[ha < hb]
+        else:
+            self.root = x
+        self.updatePath(x)
+        grew = self.insertFixup(x)
+        return self.root, max(ha, hb) + grew
+
+    def split(self, key):
+        """move the nodes of this tree into two new trees, one with the
+           keys less than key and one with the rest, in O(log n); this
+           tree is left empty.  The new trees share its sentinel."""
+        left = self.emptyTree()
+        right = self.emptyTree()
+        sentinel = self.sentinel
+
+        # the search path for key, with the black height below each
+        # node; the subtrees hanging off the path are joined back
+        # bottom up, each side in key order
+        path = []
+        cur = self.root
+        height = self.blackHeight(cur)
+        while cur != sentinel:
+            if cur.color == BLACK:
+                height -= 1
+            goLeft = self.__cmp(key, cur.key) <= 0
+            path.append((cur, height, goLeft))
+            if goLeft:
+                cur = cur.left
+            else:
+                cur = cur.right
+
+        low = high = sentinel
+        hLow = hHigh = 1
+        for x, height, goLeft in reversed(path):
+            if goLeft:
+                sub = x.right
+            else:
+                sub = x.left
+            if sub != sentinel:
+                sub.parent = None
+            x.left = x.right = sentinel
+            if goLeft:
+                high, hHigh = self.joinRoots(high, hHigh, x, sub, height)
+            else:
+                low, hLow = self.joinRoots(sub, height, x, low, hLow)
+
+        # the thread list is cut between the last key of low and the
+        # first key of high
+        left.root, right.root = low, high
+        left.elements, right.elements = low.size, high.size
+        if low != sentinel:
+            last = low
+            while last.right != sentinel:
+                last = last.right
+            left.head, left.tail = self.head, last
+            right.head = last.next
+            last.next = None
+        else:
+            right.head = self.head
+        if high != sentinel:
+            right.tail = self.tail
+            right.head.prev = None
+
+        self.root = sentinel
+        self.head = self.tail = None
+        self.elements = 0
+        return left, right
+
+    @staticmethod
+    def join(left, right):
+        """move the nodes of right into left, in O(log n), and return
+           left; every key of left has to be less than every key of
+           right.  Trees split from the same tree share a sentinel; for
+           trees with different sentinels the leaves of the smaller one
+           are first pointed to the sentinel of the larger, in O(m)."""
+        if right.root == right.sentinel:
+            return left
+        if left.root == left.sentinel:
+            left.moveFrom(right)
+            return left
+        if left.__cmp(left.tail.key, right.head.key) >= 0:
+            raise ValueError ("join: keys of left are not all less than those of right")
+
+        if left.sentinel is not right.sentinel:
+            if left.elements < right.elements:
+                small, big = left, right
+            else:
+                small, big = right, left
+            for x in small.nodes():
+                if x.left == small.sentinel:
+                    x.left = big.sentinel
+                if x.right == small.sentinel:
+                    x.right = big.sentinel
+            small.sentinel = big.sentinel
+
+        # the first node of right goes in between
+        x = right.head
+        right.deleteNode(x)
+        last = left.tail
+        elements = left.elements + right.elements + 1
+        left.root, height = left.joinRoots(left.root, left.blackHeight(left.root),
+                                           x, right.root, right.blackHeight(right.root))
+        last.next = x
+        x.prev = last
+        x.next = right.head
+        if right.head:
+            right.head.prev = x
+            left.tail = right.tail
+        else:
+            left.tail = x
+        left.elements = elements
+
+        right.root = right.sentinel
+        right.head = right.tail = None
+        right.elements = 0
+        return left
+
+    def extract_range(self, lo, hi):
+        """remove the nodes with lo <= key < hi and return them as a tree
+           of the same class, in O(log n)"""
+        left, rest = self.split(lo)
+        middle, right = rest.split(hi)
+        self.moveFrom(RBTree.join(left, right))
+        return middle
+
+    def delete_range(self, lo, hi):
+        """delete the nodes with lo <= key < hi; returns the number of
+           keys deleted, counting repeats"""
+        middle = self.extract_range(lo, hi)
+        return middle.root.total
+
+    def save(self, path):
+        """write a snapshot of the tree to path, see SNAPSHOT_MAGIC"""
+        nodes = self.nodes()
+        flags = 0
+        if self.unique:
+            flags |= SNAPSHOT_UNIQUE
+        if self.aggregate:
+            flags |= SNAPSHOT_AGGREGATE
+        columns = [packColumn([x.key for x in nodes])]
+        for x in nodes:
+            if x.value is not x.key:
+                flags |= SNAPSHOT_VALUES
+                columns.append(packColumn([x.value for x in nodes]))
+                break
+        for x in nodes:
+            if x.count != 1:
+                flags |= SNAPSHOT_COUNTS
+                columns.append(packColumn([x.count for x in nodes]))
+                break
+
+        f = open(path, 'wb')
+        try:
+            f.write(struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, flags, len(nodes)))
+            for kind, data in columns:
+                f.write(struct.pack(SNAPSHOT_COLUMN, kind, len(data)))
+                f.write(data)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, path, cmpfn=cmp):
+        """build a tree from a snapshot written by save, in O(n).  The
+           keys are trusted to be in order for cmpfn, which has to be
+           the comparison function of the saved tree."""
+        f = open(path, 'rb')
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            magic, flags, n = struct.unpack_from(SNAPSHOT_HEADER, data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError ("%s is not a tree snapshot" % path)
+            offset = struct.calcsize(SNAPSHOT_HEADER)
+            columns = []
+            while offset < len(data):
+                kind, size = struct.unpack_from(SNAPSHOT_COLUMN, data, offset)
+                offset += struct.calcsize(SNAPSHOT_COLUMN)
+                columns.append(unpackColumn(kind, data[offset:offset + size]))
+                offset += size
+        finally:
+            data.close()
+
+        keys = columns.pop(0)
+        if flags & SNAPSHOT_VALUES:
+            values = columns.pop(0)
+        else:
+            values = keys
+        if flags & SNAPSHOT_COUNTS:
+            counts = columns.pop(0)
+        else:
+            counts = None
+        if len(keys) != n or len(values) != n or \
+           counts is not None and len(counts) != n:
+            raise ValueError ("%s: truncated snapshot" % path)
+
+        # the subclass constructors differ, and have nothing to add
+        tree = object.__new__(cls)
+        RBTree.__init__(tree, cmpfn, bool(flags & SNAPSHOT_UNIQUE),
+                        bool(flags & SNAPSHOT_AGGREGATE))
+        # nothing here can be garbage, so don't let the collector walk
+        # the growing tree again and again
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            nodes = [RBNode(key, value, BLACK) for key, value in izip(keys, values)]
+            if counts is not None:
+                for x, count in izip(nodes, counts):
+                    x.count = count
+            tree.linkNodes(nodes)
+        finally:
+            if collect:
+                gc.enable()
+        return tree
+
     def traverseTree(self, f):
         if self.root == self.sentinel:
             return
@@ -496,46 +1385,22 @@ class RBTree(object):
         return result
 
     def firstNode(self):
-        cur = self.root
-        while cur.left:
-            cur = cur.left
-        return cur
+        if self.head is None:
+            return self.sentinel
+        return self.head
 
     def lastNode(self):
-        cur = self.root
-        while cur.right:
-            cur = cur.right
-        return cur
+        if self.tail is None:
+            return self.sentinel
+        return self.tail
 
     def nextNode(self, prev):
         """returns None if there isn't one"""
-        cur = prev
-        if cur.right:
-            cur = prev.right
-            while cur.left:
-                cur = cur.left
-            return cur
-        while 1:
-            cur = cur.parent
-            if not cur:
-                return None
-            if self.__cmp(cur.key, prev.key)>=0:
-                return cur
+        return prev.next
 
     def prevNode(self, next):
         """returns None if there isn't one"""
-        cur = next
-        if cur.left:
-            cur = next.left
-            while cur.right:
-                cur = cur.right
-            return cur
-        while 1:
-            cur = cur.parent
-            if cur is None:
-                return None
-            if self.__cmp(cur.key, next.key)<0:
-                return cur
+        return next.prev
 
 
 class RBList(RBTree):
@@ -543,12 +1408,18 @@ class RBList(RBTree):
         Assumes you are putting sortable items into the list.
     """
 
-    def __init__(self, list=[], cmpfn=cmp, unique=True):
+    def __init__(self, list=[], cmpfn=cmp, unique=True, aggregate=False):
         #SF new option: unique trees, see RBTree.__init__() for 
         #SF more information
-        RBTree.__init__(self, cmpfn, unique)
-        for item in list:
-            self.insertNode (item, item)
+        RBTree.__init__(self, cmpfn, unique, aggregate)
+        self.loadSorted (self.sortPairs ([(item, item) for item in list]))
+
+    @classmethod
+    def from_sorted(cls, list, cmpfn=cmp, unique=True, aggregate=False):
+        """build a list from items in ascending order in O(n)"""
+        rbList = cls ([], cmpfn, unique, aggregate)
+        rbList.loadSorted ([(item, item) for item in list])
+        return rbList
 
     def __getitem__ (self, index):
         node = self.findNodeByIndex (index)
@@ -568,23 +1439,7 @@ class RBList(RBTree):
     def findNodeByIndex (self, index):
         if (index < 0) or (index >= self.elements):
             raise IndexError ("pop index out of range")
-        #
-        if index < self.elements / 2:
-            # simple scan from start of list
-            node = self.firstNode()
-            currIndex = 0
-            while currIndex < index:
-                node = self.nextNode (node)
-                currIndex += 1
-        else:
-            # simple scan from end of list
-            node = self.lastNode()
-            currIndex = self.elements - 1
-            while currIndex > index:
-                node = self.prevNode (node)
-                currIndex -= 1
-        #
-        return node
+        return self.select (index)
 
     def insert (self, item):
         #SF The function inserNode already checks for existing Nodes 
@@ -611,15 +1466,9 @@ class RBList(RBTree):
         return node.count
 
     def index (self, item):
-        index = -1
-        node = self.findNode (item)
-        while node is not None:
-            node = self.prevNode (node)
-            index += 1
-        #
-        if index < 0:
+        if self.findNode (item) is None:
             raise ValueError ("RBList.index: item not in list")
-        return index
+        return self.rank (item)
 
     def extend (self, otherList):
         for item in otherList:
@@ -640,6 +1489,10 @@ class RBList(RBTree):
         if node is not None:
             self.deleteNode (node, all)
 
+    def copy (self):
+        """return shallow copy"""
+        return self.cloneTree()
+
     def reverse (self): # not implemented
         raise AssertionError ("RBlist.reverse Not implemented")
 
@@ -654,7 +1507,10 @@ class RBList(RBTree):
         self.sentinel.left = self.sentinel.right = self.sentinel
         self.sentinel.color = BLACK
         self.sentinel.nonzero = 0
+        self.sentinel.size = 0
+        self.sentinel.total = 0
         self.root = self.sentinel
+        self.head = self.tail = None
         self.elements = 0
 
     def values (self):
@@ -668,10 +1524,22 @@ class RBList(RBTree):
 
 class RBDict(RBTree):
 
-    def __init__(self, dict={}, cmpfn=cmp):
-        RBTree.__init__(self, cmpfn)
-        for key, value in dict.items():
-            self[key]=value
+    def __init__(self, dict={}, cmpfn=cmp, aggregate=False):
+        RBTree.__init__(self, cmpfn, True, aggregate)
+        self.loadSorted(self.sortPairs(dict.items()))
+
+    @classmethod
+    def from_sorted(cls, pairs, cmpfn=cmp, aggregate=False):
+        """build a dictionary from (key, value) pairs in ascending key
+           order in O(n)"""
+        rbDict = cls({}, cmpfn, aggregate)
+        rbDict.loadSorted(pairs)
+        return rbDict
+
+    def loadSorted(self, pairs):
+        """as RBTree.loadSorted; a key equal to the one before it
+           replaces its value, as self[key] = value does"""
+        RBTree.loadSorted(self, pairs, True)
 
     def __str__(self):
         # eval(str(self)) returns a regular dictionary
@@ -690,6 +1558,8 @@ class RBDict(RBTree):
         n = self.findNode(key)
         if n:
             n.value = value
+            if self.aggregate:
+                self.updatePath(n)
         else:
             self.insertNode(key, value)
 
@@ -728,22 +1598,44 @@ class RBDict(RBTree):
         self.sentinel.left = self.sentinel.right = self.sentinel
         self.sentinel.color = BLACK
         self.sentinel.nonzero = 0
+        self.sentinel.size = 0
+        self.sentinel.total = 0
         self.root = self.sentinel
+        self.head = self.tail = None
         self.elements = 0
 
     def copy(self):
         """return shallow copy"""
-        # there may be a more efficient way of doing this
-        return RBDict(self)
+        return self.cloneTree()
 
     def update(self, other):
-        """Add all items from the supplied mapping to this one.
+        """Add all items from the supplied mapping, or sequence of
+        (key, value) pairs, to this one.
 
-        Will overwrite old entries with new ones.
+        Will overwrite old entries with new ones.  Unless other is small
+        next to this dictionary, the two are merged in key order and the
+        tree is rebuilt in O(n + m) instead of inserting key by key.
 
         """
-        for key in other.keys():
-            self[key] = other[key]
+        if self.sameOrder(other):
+            pairs = [(x.key, x.value) for x in other.nodes()]
+        elif hasattr(other, 'items'):
+            pairs = other.items()
+        elif hasattr(other, 'keys'):
+            pairs = [(key, other[key]) for key in other.keys()]
+        else:
+            pairs = list(other)
+
+        # an insert takes about log2(n) steps, a merge one step for each
+        # of the n + m keys
+        n = self.elements
+        if len(pairs) * max(1, n.bit_length()) * MERGE_STEPS < n + len(pairs):
+            for key, value in pairs:
+                self[key] = value
+            return
+        if not self.sameOrder(other):
+            pairs = self.sortPairs(pairs)
+        self.mergeSorted(pairs)
 
     def setdefault(self, key, value=None):
         if self.has_key(key):
@@ -752,9 +1644,325 @@ class RBDict(RBTree):
         return value
 
 
+class PNode(object):
+    """immutable node of a PersistentRBTree; None is the empty tree"""
+    __slots__ = ('color', 'left', 'key', 'count', 'right', 'size', 'total')
+
+    def __init__(self, color, left, key, count, right):
+        self.color = color
+        self.left = left
+        self.key = key
+        self.count = count
+        self.right = right
+        self.size = 1
+        self.total = count
+        if left is not None:
+            self.size += left.size
+            self.total += left.total
+        if right is not None:
+            self.size += right.size
+            self.total += right.total
+
+
+def isRed(t):
+    return t is not None and t.color == RED
+
+def redden(t):
+    return PNode(RED, t.left, t.key, t.count, t.right)
+
+def blacken(t):
+    if t is None or t.color == BLACK:
+        return t
+    return PNode(BLACK, t.left, t.key, t.count, t.right)
+
+def balance(a, x, b):
+    """a black node with the key and count of x between a and b, where
+       one of them may have a red child under a red root (Kahrs)"""
+    if isRed(a) and isRed(b):
+        return PNode(RED, blacken(a), x.key, x.count, blacken(b))
+    if isRed(a):
+        if isRed(a.left):
+            return PNode(RED, blacken(a.left), a.key, a.count,
+                         PNode(BLACK, a.right, x.key, x.count, b))
+        if isRed(a.right):
+            y = a.right
+            return PNode(RED, PNode(BLACK, a.left, a.key, a.count, y.left),
+                         y.key, y.count, PNode(BLACK, y.right, x.key, x.count, b))
+    if isRed(b):
+        if isRed(b.right):
+            return PNode(RED, PNode(BLACK, a, x.key, x.count, b.left),
+                         b.key, b.count, blacken(b.right))
+        if isRed(b.left):
+            y = b.left
+            return PNode(RED, PNode(BLACK, a, x.key, x.count, y.left),
+                         y.key, y.count, PNode(BLACK, y.right, b.key, b.count, b.right))
+    return PNode(BLACK, a, x.key, x.count, b)
+
+def balleft(a, x, b):
+    """rebalance after the black height of a dropped by one"""
+    if isRed(a):
+        return PNode(RED, blacken(a), x.key, x.count, b)
+    if b.color == BLACK:
+        return balance(a, x, redden(b))
+    y = b.left
+    return PNode(RED, PNode(BLACK, a, x.key, x.count, y.left), y.key, y.count,
+                 balance(y.right, b, redden(b.right)))
+
+def balright(a, x, b):
+    """rebalance after the black height of b dropped by one"""
+    if isRed(b):
+        return PNode(RED, a, x.key, x.count, blacken(b))
+    if a.color == BLACK:
+        return balance(redden(a), x, b)
+    y = a.right
+    return PNode(RED, balance(redden(a.left), a, y.left), y.key, y.count,
+                 PNode(BLACK, y.right, x.key, x.count, b))
+
+def fuse(a, b):
+    """join a and b, of equal black height, all keys of a first"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isRed(a) and isRed(b):
+        m = fuse(a.right, b.left)
+        if isRed(m):
+            return PNode(RED, PNode(RED, a.left, a.key, a.count, m.left), m.key, m.count,
+                         PNode(RED, m.right, b.key, b.count, b.right))
+        return PNode(RED, a.left, a.key, a.count, PNode(RED, m, b.key, b.count, b.right))
+    if isRed(b):
+        return PNode(RED, fuse(a, b.left), b.key, b.count, b.right)
+    if isRed(a):
+        return PNode(RED, a.left, a.key, a.count, fuse(a.right, b))
+    m = fuse(a.right, b.left)
+    if isRed(m):
+        return PNode(RED, PNode(BLACK, a.left, a.key, a.count, m.left), m.key, m.count,
+                     PNode(BLACK, m.right, b.key, b.count, b.right))
+    return balleft(a.left, a, PNode(BLACK, m, b.key, b.count, b.right))
+
+
+class PersistentRBTree(object):
+    """ Red-black multiset whose updates never change a node.
+
+        insertNode and deleteNode copy the nodes on the search path and
+        rebalance on the way back up (Okasaki's insert and Kahrs' delete
+        in the form of Kahrs' "Red-black trees with types"), so every
+        update makes O(log n) new nodes and a new root sharing all
+        other nodes with the previous one.  The root after every update
+        is kept in self.versions, versions[0] being the empty tree, so
+        median, rank and membership can be asked of any earlier version
+        in O(log n).  Like the non unique RBTree, equal keys share one
+        node and are counted in node.count.
+    """
+
+    def __init__(self, cmpfn=cmp):
+        self.versions = [None]
+        self.__cmp = cmpfn
+
+    def __len__(self):
+        return self.size()
+
+    def root(self, version=None):
+        if version is None:
+            return self.versions[-1]
+        return self.versions[version]
+
+    def size(self, version=None):
+        """number of keys in a version, counting repeats"""
+        root = self.root(version)
+        if root is None:
+            return 0
+        return root.total
+
+    def findNode(self, key, version=None):
+        cur = self.root(version)
+        while cur is not None:
+            rc = self.__cmp(key, cur.key)
+            if rc == 0:
+                return cur
+            if rc < 0:
+                cur = cur.left
+            else:
+                cur = cur.right
+        return None
+
+    def contains(self, key, version=None):
+        return self.findNode(key, version) is not None
+
+    def count(self, key, version=None):
+        node = self.findNode(key, version)
+        if node is None:
+            return 0
+        return node.count
+
+    def insertNode(self, key):
+        """add one copy of key as a new version"""
+        cmpfn = self.__cmp
+
+        def ins(t):
+            if t is None:
+                return PNode(RED, None, key, 1, None)
+            rc = cmpfn(key, t.key)
+            if rc == 0:
+                return PNode(t.color, t.left, t.key, t.count + 1, t.right)
+            if t.color == RED:
+                if rc < 0:
+                    return PNode(RED, ins(t.left), t.key, t.count, t.right)
+                return PNode(RED, t.left, t.key, t.count, ins(t.right))
+            if rc < 0:
+                return balance(ins(t.left), t, t.right)
+            return balance(t.left, t, ins(t.right))
+
+        self.versions.append(blacken(ins(self.versions[-1])))
+
+    def deleteNode(self, key, all=False):
+        """remove one copy of key, or all of them, as a new version;
+           ValueError if there is none, still recording a version so
+           that versions keep following the ops"""
+        cmpfn = self.__cmp
+        root = self.versions[-1]
+        node = self.findNode(key)
+        if node is None:
+            self.versions.append(root)
+            raise ValueError ("PersistentRBTree.deleteNode: key not in tree")
+
+        def delete(t):
+            rc = cmpfn(key, t.key)
+            if rc == 0:
+                if t.count > 1 and not all:
+                    return PNode(t.color, t.left, t.key, t.count - 1, t.right)
+                return fuse(t.left, t.right)
+            if rc < 0:
+                if t.left.color == BLACK:
+                    return balleft(delete(t.left), t, t.right)
+                return PNode(RED, delete(t.left), t.key, t.count, t.right)
+            if t.right.color == BLACK:
+                return balright(t.left, t, delete(t.right))
+            return PNode(RED, t.left, t.key, t.count, delete(t.right))
+
+        if node.count > 1 and not all:
+            # no node goes away, so the shape and colors stay
+            def decrement(t):
+                rc = cmpfn(key, t.key)
+                if rc == 0:
+                    return PNode(t.color, t.left, t.key, t.count - 1, t.right)
+                if rc < 0:
+                    return PNode(t.color, decrement(t.left), t.key, t.count, t.right)
+                return PNode(t.color, t.left, t.key, t.count, decrement(t.right))
+            self.versions.append(decrement(root))
+        else:
+            self.versions.append(blacken(delete(root)))
+
+    def add(self, key):
+        self.insertNode(key)
+
+    def remove(self, key):
+        self.deleteNode(key)
+
+    def kth(self, k, version=None):
+        """k-th smallest key of a version (0 based), counting repeats"""
+        cur = self.root(version)
+        if cur is None or k < 0 or k >= cur.total:
+            raise IndexError ("kth index out of range")
+        while 1:
+            before = 0
+            if cur.left is not None:
+                before = cur.left.total
+            if k < before:
+                cur = cur.left
+            elif k < before + cur.count:
+                return cur.key
+            else:
+                k -= before + cur.count
+                cur = cur.right
+
+    def rank(self, key, version=None):
+        """number of keys less than key in a version, counting repeats"""
+        cur = self.root(version)
+        result = 0
+        while cur is not None:
+            if self.__cmp(key, cur.key) <= 0:
+                cur = cur.left
+            else:
+                result += cur.total
+                if cur.right is not None:
+                    result -= cur.right.total
+                cur = cur.right
+        return result
+
+    def median(self, version=None):
+        n = self.size(version)
+        if not n:
+            raise ValueError
+        if n % 2:
+            return self.kth(n // 2, version)
+        return (self.kth(n // 2 - 1, version) + self.kth(n // 2, version)) / 2.0
+
+    def keys(self, version=None):
+        """the keys of a version in order, each once"""
+        result = []
+        stack = []
+        cur = self.root(version)
+        while stack or cur is not None:
+            if cur is not None:
+                stack.append(cur)
+                cur = cur.left
+            else:
+                cur = stack.pop()
+                result.append(cur.key)
+                cur = cur.right
+        return result
+
+
 """ ----------------------------------------------------------------------------
     TEST ROUTINES
 """
+def checkTree(tree):
+    """assert the red-black properties and the augmented fields of tree,
+       returns the black height"""
+    def check(x):
+        if x == tree.sentinel:
+            return 1
+        if x.color == RED:
+            assert x.left.color == BLACK and x.right.color == BLACK
+        for child in (x.left, x.right):
+            if child != tree.sentinel:
+                assert child.parent is x
+        assert x.size == x.left.size + x.right.size + 1
+        assert x.total == x.left.total + x.right.total + x.count
+        if tree.aggregate:
+            assert x.sum == x.left.sum + x.right.sum + x.value * x.count
+            assert x.low == min([x.value] + [y.low for y in (x.left, x.right) if y.size])
+            assert x.high == max([x.value] + [y.high for y in (x.left, x.right) if y.size])
+        height = check(x.left)
+        assert height == check(x.right)
+        return height + (x.color == BLACK)
+    assert tree.root.color == BLACK
+    assert tree.root.size == len(tree)
+    nodes = tree.nodesByTraversal()
+    assert nodes == tree.nodes()
+    for a, b in zip([None] + nodes, nodes + [None]):
+        assert (a is None and tree.head is b) or a.next is b
+        assert (b is None and tree.tail is a) or b.prev is a
+    return check(tree.root)
+
+def checkPersistent(t):
+    """assert the red-black properties and the augmented fields of the
+       PersistentRBTree version rooted at t, returns the black height"""
+    if t is None:
+        return 1
+    if t.color == RED:
+        assert not isRed(t.left) and not isRed(t.right)
+    size, total = 1, t.count
+    for child in (t.left, t.right):
+        if child is not None:
+            size += child.size
+            total += child.total
+    assert t.size == size and t.total == total
+    height = checkPersistent(t.left)
+    assert height == checkPersistent(t.right)
+    return height + (t.color == BLACK)
+
 def testRBlist():
     import random
     print "--- Testing RBList ---"
@@ -784,6 +1992,279 @@ def testRBlist():
     assert rbList.pop (0) == 0
     assert rbList.values() == [4,6]
 
+    print "    Bulk construction tests..."
+    for n in range(40) + [1000, 1023, 1024, 1025]:
+        items = range(n)
+        rbList = RBList.from_sorted (items)
+        assert rbList.values() == items
+        checkTree (rbList)
+        random.shuffle(items)
+        rbList = RBList (items)
+        assert rbList.values() == sorted(items)
+        checkTree (rbList)
+    rbList = RBList.from_sorted ([1, 1, 2, 3, 3, 3], unique=False)
+    assert rbList.values() == [1, 2, 3]
+    assert rbList.count (3) == 3
+    try:
+        RBList.from_sorted ([2, 1])
+        raise AssertionError ("unsorted input accepted")
+    except ValueError:
+        pass
+
+    print "    Order statistic tests..."
+    items = range(200)
+    random.shuffle(items)
+    rbList = RBList (items)
+    items.sort()
+    for i in range(0, 200, 3):
+        del items[items.index(i)]
+        rbList.remove (i)
+    for i in range(len(items)):
+        assert rbList[i] == items[i]
+        assert rbList.index (items[i]) == i
+        assert rbList.rank (items[i]) == i
+    assert rbList.rank (-1) == 0
+    assert rbList.rank (1000) == len(items)
+    while items:
+        i = random.randrange(len(items))
+        assert rbList.pop (i) == items.pop (i)
+        checkTree (rbList)
+
+    print "    Quantile tests..."
+    rbList = RBList (unique=False)
+    items = []
+    for i in range(300):
+        k = random.randrange(50)
+        if items and random.random() < 0.3:
+            k = random.choice(items)
+            items.remove(k)
+            rbList.remove (k, False)
+        else:
+            items.append(k)
+            rbList.insert (k)
+    checkTree (rbList)
+    items.sort()
+    for i in range(len(items)):
+        assert rbList.kth (i) == items[i]
+    n = len(items)
+    for q in (0, 0.1, 0.25, 0.5, 0.9, 0.99, 1):
+        pos = q * (n - 1)
+        low, high = items[int(pos)], items[min(int(pos) + 1, n - 1)]
+        assert rbList.quantile (q, 'lower') == low
+        assert rbList.quantile (q, 'higher') == (high, low)[pos == int(pos)]
+        assert abs(rbList.quantile (q) - (low + (high - low) * (pos - int(pos)))) < 1e-9
+    assert rbList.quantile (0.5, 'midpoint') == (items[(n - 1) // 2] + items[n // 2]) / 2.0
+    for interpolation in ('lower', 'higher', 'nearest', 'midpoint', 'linear'):
+        assert rbList.quantile (0, interpolation) == items[0]
+        assert rbList.quantile (1, interpolation) == items[-1]
+
+    print "    Snapshot tests..."
+    import os, tempfile
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        rbList = RBList ([], unique=False)
+        for i in range(200):
+            rbList.insert (random.randrange(50))
+        rbList.save (path)
+        copy = RBList.load (path)
+        checkTree (copy)
+        assert copy.unique == False
+        assert [(x.key, x.count) for x in copy.nodes()] == \
+               [(x.key, x.count) for x in rbList.nodes()]
+        for items in ({}, {1: 'a', 2.5: None, 'x': [1]}, {1.5: 2.5, 3.0: 4.5}):
+            rbDict = RBDict (items)
+            rbDict.save (path)
+            copy = RBDict.load (path)
+            checkTree (copy)
+            assert copy.items() == rbDict.items()
+        rbDict = RBDict (dict((i, i * i) for i in range(20)), cmp, True)
+        rbDict.save (path)
+        copy = RBDict.load (path)
+        checkTree (copy)
+        assert copy.aggregate and copy.sum_range (3, 6) == 9 + 16 + 25
+        assert copy.max_range (0, 20) == 361
+        # a counts column shorter than the keys
+        f = open (path, 'wb')
+        f.write (struct.pack (SNAPSHOT_HEADER, SNAPSHOT_MAGIC,
+                              SNAPSHOT_COUNTS, 3))
+        for column in ([1, 2, 3], [2, 2]):
+            kind, data = packColumn (column)
+            f.write (struct.pack (SNAPSHOT_COLUMN, kind, len(data)) + data)
+        f.close ()
+        try:
+            RBList.load (path)
+            assert False
+        except ValueError:
+            pass
+    finally:
+        os.remove (path)
+
+    print "    Split and join tests..."
+    for n in range(0, 100, 7):
+        items = range(0, 2 * n, 2)
+        for key in range(-1, 2 * n + 2, 3):
+            left, right = RBList (items).split (key)
+            checkTree (left)
+            checkTree (right)
+            assert left.values() == [i for i in items if i < key]
+            assert right.values() == [i for i in items if i >= key]
+            rbList = RBTree.join (left, right)
+            checkTree (rbList)
+            assert rbList.values() == items
+            assert len(right) == 0
+        rbList = RBTree.join (RBList (items), RBList ([2 * n + 1, 2 * n + 3]))
+        checkTree (rbList)
+        assert rbList.values() == items + [2 * n + 1, 2 * n + 3]
+        middle = rbList.extract_range (n // 2, n)
+        checkTree (rbList)
+        checkTree (middle)
+        assert middle.values() == [i for i in items if n // 2 <= i < n]
+        assert rbList.delete_range (n, 2 * n + 4) == len([i for i in items if i >= n]) + 2
+        checkTree (rbList)
+        assert rbList.values() == [i for i in items if i < n // 2]
+
+    print "    Copy tests..."
+    rbList = RBList (unique=False)
+    for i in range(200):
+        rbList.insert (random.randrange(50))
+    copy = rbList.copy ()
+    checkTree (copy)
+    assert [(x.key, x.count, x.color) for x in copy.nodesByTraversal()] == \
+           [(x.key, x.count, x.color) for x in rbList.nodesByTraversal()]
+    copy.insert (100)
+    copy.remove (copy[0])
+    assert 100 not in rbList
+    checkTree (rbList)
+    rbDict = RBDict (dict((i, str(i)) for i in range(50)), lambda x, y: cmp(y, x))
+    copy = rbDict.copy ()
+    checkTree (copy)
+    assert copy.items() == rbDict.items()
+    copy[100] = 'x'
+    assert copy.keys()[0] == 100 and not rbDict.has_key (100)
+
+    print "    Update tests..."
+    for n, m in ((0, 40), (0, 2000), (300, 5), (300, 200), (50, 400)):
+        pairs = dict((random.randrange(500), random.randrange(100)) for i in range(n))
+        rbDict = RBDict (pairs, cmp, True)
+        for other in (dict((random.randrange(500), random.randrange(100))
+                           for i in range(m)),
+                      RBDict (dict((random.randrange(500), random.randrange(100))
+                                   for i in range(m)), cmp, True),
+                      [(random.randrange(500), random.randrange(100))
+                       for i in range(m)]):
+            rbDict.update (other)
+            pairs.update (other)
+            checkTree (rbDict)
+            assert rbDict.items() == sorted(pairs.items())
+    # keys equal under the comparison keep the last value, silently
+    import StringIO, sys
+    def nocase(x, y):
+        return cmp(x.lower(), y.lower())
+    out = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        rbDict = RBDict ({'a': 1, 'A': 2, 'b': 3}, nocase)
+        warnings = sys.stdout.getvalue()
+        last = RBDict.from_sorted ([('a', 1), ('A', 2), ('b', 3)], nocase)
+    finally:
+        sys.stdout = out
+    assert warnings == '' and len(rbDict) == 2 and rbDict['b'] == 3
+    assert last.items() == [('a', 2), ('b', 3)]
+    # a large update of an empty dictionary is merged
+    rbDict = RBDict ()
+    merged = []
+    rbDict.mergeSorted = lambda pairs: (merged.append (len(pairs)),
+                                        RBDict.mergeSorted (rbDict, pairs))
+    rbDict.update (dict((i, i) for i in range(1000)))
+    assert merged == [1000] and rbDict.keys() == range(1000)
+    checkTree (rbDict)
+    # a tree in another order is merged by its keys
+    rbDict = RBDict (dict((i, i) for i in range(0, 100, 2)))
+    rbDict.update (RBDict (dict((i, -i) for i in range(90)), lambda x, y: cmp(y, x)))
+    checkTree (rbDict)
+    assert rbDict.keys() == range(90) + range(90, 100, 2)
+    assert rbDict[4] == -4 and rbDict[96] == 96
+    rbList = RBList (range(0, 20, 2), cmp, False)
+    rbList.mergeSorted ([(i, i) for i in range(10)])
+    checkTree (rbList)
+    assert [(x.key, x.count) for x in rbList.nodes()] == \
+           [(i, 1 + (i < 10 and i % 2 == 0)) for i in range(20) if i < 10 or i % 2 == 0]
+
+    print "    Bound and iterator tests..."
+    rbList = RBList ([random.randrange(0, 100, 3) for i in range(60)], cmp, False)
+    keys = sorted(set(rbList))
+    assert list(rbList) == keys and list(reversed(rbList)) == keys[::-1]
+    for k in range(-2, 103):
+        above = [x for x in keys if x >= k]
+        assert (rbList.lower_bound (k) or RBNode()).key == (above or [None])[0]
+        assert rbList.ceiling (k) is rbList.lower_bound (k)
+        above = [x for x in keys if x > k]
+        assert (rbList.upper_bound (k) or RBNode()).key == (above or [None])[0]
+        below = [x for x in keys if x <= k]
+        assert (rbList.floor (k) or RBNode()).key == (below or [None])[-1]
+    for i in range(200):
+        lo = random.choice([None, random.randrange(-5, 105)])
+        hi = random.choice([None, random.randrange(-5, 105)])
+        inside = [x for x in keys if (lo is None or x >= lo) and
+                                     (hi is None or x < hi)]
+        assert [x.key for x in rbList.irange (lo, hi)] == inside
+        assert [x.key for x in rbList.irange (lo, hi, True)] == inside[::-1]
+    rbDict = RBDict (dict((i, -i) for i in range(20)), lambda x, y: cmp(y, x))
+    assert rbDict.lower_bound (5).key == 5 and rbDict.upper_bound (5).key == 4
+    assert rbDict.floor (5).key == 5 and rbDict.floor (20) is None
+    assert [tuple(x) for x in rbDict.irange (10, 7)] == [(10, -10), (9, -9), (8, -8)]
+    assert [x.key for x in rbDict.irange (None, 16, True)] == [17, 18, 19]
+    assert list(rbDict.irange (20, 30)) == list(RBList().irange ()) == []
+    assert list(iter(rbDict)) == [-i for i in range(19, -1, -1)]
+
+    print "    Range aggregate tests..."
+    rbDict = RBDict ({}, cmp, True)
+    pairs = {}
+    for i in range(300):
+        k = random.randrange(100)
+        if k in pairs and random.random() < 0.3:
+            del rbDict[k]
+            del pairs[k]
+        else:
+            pairs[k] = rbDict[k] = random.randrange(-50, 50)
+    checkTree (rbDict)
+    for lo in range(-5, 105, 6):
+        for hi in (lo - 1, lo + 1, lo + 17, lo + 60):
+            values = [v for k, v in pairs.items() if lo <= k < hi]
+            assert rbDict.count_range (lo, hi) == len(values)
+            assert rbDict.sum_range (lo, hi) == sum(values)
+            if values:
+                assert rbDict.min_range (lo, hi) == min(values)
+                assert rbDict.max_range (lo, hi) == max(values)
+
+    print "    Persistent tree tests..."
+    tree = PersistentRBTree ()
+    history = [[]]
+    items = []
+    for i in range(300):
+        k = random.randrange(40)
+        if random.random() < 0.6:
+            tree.insertNode (k)
+            items.append(k)
+        else:
+            try:
+                tree.deleteNode (k)
+                items.remove(k)
+            except ValueError:
+                assert k not in items
+        history.append(sorted(items))
+        assert checkPersistent (tree.root ()) >= 1
+    for version, items in enumerate(history):
+        n = len(items)
+        assert tree.size (version) == n
+        assert tree.keys (version) == sorted(set(items))
+        if n:
+            assert tree.median (version) == (items[(n - 1) // 2] + items[n // 2]) / 2.0
+        for k in range(0, 40, 5):
+            assert tree.contains (k, version) == (k in items)
+            assert tree.rank (k, version) == len([i for i in items if i < k])
+
     # Random number insertion test
     rbList = RBList()
     for i in range(5):
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# Approximate running median in bounded memory, from KLL sketches
+# (Karnin, Lang, Liberty: "Optimal quantile approximation in streams").
+#
+# A KLL sketch keeps a stack of compactors.  Values enter level 0; when
+# the sketch holds too many values, a full level is sorted and every
+# other value (from a random start) moves up one level, where it stands
+# for twice as many values of the stream.  Capacities shrink by c = 2/3
+# going down from the top level, so the sketch holds about 3k values
+# (600 for the default k = 200) however long the stream is, and the
+# rank of any value is off by about n/k at most with high probability.
+# Two sketches merge by joining their levels and compacting again.
+#
+# A sketch cannot forget a value, so removes go into a second sketch
+# and ranks are read as rank in the adds minus rank in the removes.
+# The rank error then grows with the total number of ops, adds plus
+# removes, not with the number of live values: with k = 200 it stays
+# well under 1% of the ops.  A stream removing most of what it adds will
+# see a large error relative to its size.  Removes are not checked
+# against the values added either: removing a value never added only
+# shifts the median, where the exact trackers raise ValueError.
+#
+# usage: python SketchMedian.py [n] [k]    checks the error on n values
+
+import math
+from random import random
+
+K = 200
+C = 2.0 / 3
+
+
+class KLL(object):
+
+    def __init__(self, k=K, c=C):
+        self.k = k
+        self.c = c
+        self.compactors = []
+        self.n = 0
+        self.held = 0
+        self.grow()
+
+    def __len__(self):
+        return self.n
+
+    def grow(self):
+        self.compactors.append([])
+        self.limit = sum(self.capacity(h) for h in xrange(len(self.compactors)))
+
+    def capacity(self, h):
+        depth = len(self.compactors) - h - 1
+        return int(math.ceil(self.k * self.c ** depth)) + 1
+
+    def update(self, e):
+        self.compactors[0].append(e)
+        self.n += 1
+        self.held += 1
+        if self.held >= self.limit:
+            self.compress()
+
+    def compress(self):
+        """compact full levels, lowest first, until the sketch is back
+           under its size limit"""
+        h = 0
+        while h < len(self.compactors):
+            level = self.compactors[h]
+            if len(level) >= self.capacity(h):
+                if h + 1 == len(self.compactors):
+                    self.grow()
+                level.sort()
+                odd = len(level) % 2
+                start = odd + (random() < 0.5)
+                self.compactors[h + 1].extend(level[start::2])
+                self.held -= len(level) - odd - len(level[start::2])
+                del level[odd:]
+                if self.held < self.limit:
+                    break
+            h += 1
+
+    def merge(self, other):
+        """add the values summarized by other to this sketch"""
+        while len(self.compactors) < len(other.compactors):
+            self.grow()
+        for h, level in enumerate(other.compactors):
+            self.compactors[h].extend(level)
+        self.n += other.n
+        self.held += other.held
+        while self.held >= self.limit:
+            self.compress()
+
+    def weighted(self):
+        """(value, weight) pairs of the values held"""
+        pairs = []
+        for h, level in enumerate(self.compactors):
+            w = 1 << h
+            pairs.extend((e, w) for e in level)
+        return pairs
+
+    def rank(self, e):
+        """estimated number of values less or equal to e"""
+        r = 0
+        for h, level in enumerate(self.compactors):
+            r += sum(1 for x in level if x <= e) << h
+        return r
+
+
+class SketchMedian(object):
+
+    def __init__(self, k=K):
+        self.adds = KLL(k)
+        self.removes = KLL(k)
+
+    def __len__(self):
+        return len(self.adds) - len(self.removes)
+
+    def add(self, e):
+        self.adds.update(e)
+
+    def remove(self, e):
+        """count a remove of e; ValueError only if nothing is left"""
+        if not len(self):
+            raise ValueError("SketchMedian.remove: no values left")
+        self.removes.update(e)
+
+    def merge(self, other):
+        self.adds.merge(other.adds)
+        self.removes.merge(other.removes)
+
+    def held(self):
+        """number of values held by the sketches"""
+        return self.adds.held + self.removes.held
+
+    def median(self):
+        n = len(self)
+        if not n:
+            raise ValueError
+        pairs = self.adds.weighted()
+        pairs.extend((e, -w) for e, w in self.removes.weighted())
+        pairs.sort()
+        lowRank = (n - 1) // 2
+        highRank = n // 2
+        low = None
+        seen = 0
+        for e, w in pairs:
+            seen += w
+            if low is None and seen > lowRank:
+                low = e
+            if seen > highRank:
+                break
+        if low is None:
+            low = e
+        if n % 2 or low == e:
+            return low
+        return (low + e) / 2.0
+
+
+def check(n=1000000, k=K):
+    """print the rank error of the median of n random values, before
+       and after removing half of them at random"""
+    from random import randrange, shuffle
+    values = [randrange(1 << 30) for i in xrange(n)]
+    sketch = SketchMedian(k)
+    for e in values:
+        sketch.add(e)
+
+    def error(live):
+        live = sorted(live)
+        m = sketch.median()
+        lo = sum(1 for e in live if e < m)
+        hi = sum(1 for e in live if e <= m)
+        mid = len(live) // 2
+        return max(0, lo - mid, mid - hi)
+
+    print "%d values, k = %d, %d held" % (n, k, sketch.held())
+    print "    rank error %d" % error(values)
+    shuffle(values)
+    for e in values[n // 2:]:
+        sketch.remove(e)
+    print "after %d removes, %d held" % (n - n // 2, sketch.held())
+    print "    rank error %d" % error(values[:n // 2])
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    check(*map(int, sys.argv[1:]))
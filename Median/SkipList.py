@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+#
+# Indexable skip list holding an ordered multiset.
+#
+# Equal values share one node and are counted in node.count, like the
+# non unique RBTree.  Every link also records its width: the number of
+# elements (counting repeats) it jumps over, so that rank and select
+# walk down the levels in expected O(log n) just like a search.  There
+# are no rotations or fixups; an insert or a delete only relinks the
+# node's own levels and adjusts the widths of the links passing over
+# it.
+#
+# Levels are drawn with p = 1/4, which needs 1.33 links per node on
+# average (2 with p = 1/2) for the same expected search length.
+#
+# usage: python SkipList.py [n] [spread]    runs the benchmark
+#        python SkipList.py test
+
+from random import random
+
+MAXLEVEL = 32
+P = 0.25
+
+
+class SkipNode(object):
+    __slots__ = ('value', 'count', 'next', 'width')
+
+    def __init__(self, value, level):
+        self.value = value
+        self.count = 1
+        self.next = [None] * level
+        # width[i]: elements from this node (inclusive) up to next[i]
+        # (exclusive); meaningless where next[i] is None
+        self.width = [0] * level
+
+
+class SkipList(object):
+
+    def __init__(self, items=()):
+        self.head = SkipNode(None, MAXLEVEL)
+        self.head.count = 0
+        self.level = 1
+        self.size = 0
+        for item in items:
+            self.insert(item)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not None:
+            for i in xrange(node.count):
+                yield node.value
+            node = node.next[0]
+
+    def __contains__(self, value):
+        return self.findNode(value) is not None
+
+    def __getitem__(self, index):
+        return self.select(index)
+
+    def randomLevel(self):
+        level = 1
+        while level < MAXLEVEL and random() < P:
+            level += 1
+        return level
+
+    def findPath(self, value):
+        """return the last node before value on every level, and the
+           number of elements before each of them"""
+        update = [None] * self.level
+        before = [0] * self.level
+        node = self.head
+        dist = 0
+        for i in xrange(self.level - 1, -1, -1):
+            nxt = node.next[i]
+            while nxt is not None and nxt.value < value:
+                dist += node.width[i]
+                node = nxt
+                nxt = node.next[i]
+            update[i] = node
+            before[i] = dist
+        return update, before
+
+    def findNode(self, value):
+        node = self.head
+        for i in xrange(self.level - 1, -1, -1):
+            nxt = node.next[i]
+            while nxt is not None and nxt.value < value:
+                node = nxt
+                nxt = node.next[i]
+        node = node.next[0]
+        if node is not None and node.value == value:
+            return node
+        return None
+
+    def insert(self, value):
+        update, before = self.findPath(value)
+        self.size += 1
+        node = update[0].next[0]
+        if node is not None and node.value == value:
+            node.count += 1
+            # every link jumping over node is one longer
+            for i in xrange(self.level):
+                if update[i].next[i] is not node:
+                    update[i].width[i] += 1
+            for i in xrange(len(node.next)):
+                node.width[i] += 1
+            return
+
+        level = self.randomLevel()
+        for i in xrange(self.level, level):
+            update.append(self.head)
+            before.append(0)
+        self.level = max(self.level, level)
+
+        node = SkipNode(value, level)
+        # elements before the new node
+        at = before[0] + update[0].count
+        for i in xrange(level):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            node.width[i] = prev.width[i] - (at - before[i]) + 1
+            prev.width[i] = at - before[i]
+        for i in xrange(level, self.level):
+            update[i].width[i] += 1
+
+    def add(self, value):
+        self.insert(value)
+
+    def remove(self, value):
+        """remove one copy of value, ValueError if there is none"""
+        update, before = self.findPath(value)
+        node = update[0].next[0]
+        if node is None or node.value != value:
+            raise ValueError("SkipList.remove: value not in list")
+        self.size -= 1
+        height = len(node.next)
+        if node.count > 1:
+            node.count -= 1
+            for i in xrange(self.level):
+                if update[i].next[i] is not node:
+                    update[i].width[i] -= 1
+            for i in xrange(height):
+                node.width[i] -= 1
+            return
+
+        for i in xrange(height):
+            prev = update[i]
+            prev.width[i] += node.width[i] - 1
+            prev.next[i] = node.next[i]
+        for i in xrange(height, self.level):
+            update[i].width[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+
+    def count(self, value):
+        node = self.findNode(value)
+        if node is None:
+            return 0
+        return node.count
+
+    def rank(self, value):
+        """number of elements less than value"""
+        update, before = self.findPath(value)
+        return before[0] + update[0].count
+
+    def select(self, k):
+        """k-th smallest element, 0 based"""
+        if k < 0 or k >= self.size:
+            raise IndexError("SkipList.select: index out of range")
+        node = self.head
+        dist = 0
+        for i in xrange(self.level - 1, -1, -1):
+            while node.next[i] is not None and dist + node.width[i] <= k:
+                dist += node.width[i]
+                node = node.next[i]
+        # node is the last one starting at or before k, so it covers k
+        return node.value
+
+    def median(self):
+        if not self.size:
+            raise ValueError
+        n = self.size
+        if n % 2:
+            return self.select(n // 2)
+        return (self.select(n // 2 - 1) + self.select(n // 2)) / 2.0
+
+
+def benchmark(n=100000, spread=100):
+    """time the median trackers on a duplicate heavy, delete heavy
+       stream: about as many removes as adds over few distinct values"""
+    import time
+    from random import randrange
+    from RBMedian import RBMedian
+    from HeapMedian import HeapMedian
+
+    ops = []
+    live = []
+    for i in xrange(n):
+        if live and random() < 0.48:
+            ops.append(('r', live.pop(randrange(len(live)))))
+        else:
+            e = randrange(spread)
+            live.append(e)
+            ops.append(('a', e))
+
+    print "%d ops over %d distinct values" % (n, spread)
+    for name, tracker in (("SkipList", SkipList()),
+                          ("RBMedian", RBMedian()),
+                          ("HeapMedian", HeapMedian())):
+        start = time.time()
+        for op, e in ops:
+            if op == 'a':
+                tracker.add(e)
+            else:
+                tracker.remove(e)
+            if len(tracker):
+                tracker.median()
+        print "    %-12s %.3fs" % (name, time.time() - start)
+
+
+def checkSkipList(skip):
+    """assert the link widths and the list level of skip"""
+    nodes = []
+    node = skip.head
+    while node is not None:
+        nodes.append(node)
+        node = node.next[0]
+    assert sum(node.count for node in nodes) == skip.size
+    position = dict((id(node), i) for i, node in enumerate(nodes))
+    for i, node in enumerate(nodes):
+        for h in xrange(len(node.next)):
+            nxt = node.next[h]
+            if h >= skip.level:
+                assert nxt is None
+            elif nxt is not None:
+                covered = nodes[i:position[id(nxt)]]
+                assert node.width[h] == sum(x.count for x in covered)
+    for h in xrange(skip.level):
+        # every level in use links at least one node
+        assert h == 0 or skip.head.next[h] is not None
+
+
+def testSkipList():
+    from bisect import bisect_left
+    from random import randrange
+    print "--- Testing SkipList ---"
+    print "    Random op tests..."
+    for spread in (1, 3, 20):
+        skip = SkipList()
+        values = []
+        for i in xrange(3000):
+            # about as many removes as adds over few distinct values,
+            # and an empty list now and then
+            if values and random() < 0.5:
+                e = values[randrange(len(values))]
+                skip.remove(e)
+                values.remove(e)
+            elif random() < 0.05:
+                e = spread + randrange(3)
+                try:
+                    skip.remove(e)
+                    assert False
+                except ValueError:
+                    pass
+            else:
+                e = randrange(spread)
+                skip.add(e)
+                values.insert(bisect_left(values, e), e)
+            if i % 7 == 0:
+                checkSkipList(skip)
+            n = len(values)
+            assert len(skip) == n
+            assert list(skip) == values
+            for k in (0, n // 3, n // 2, n - 1):
+                if 0 <= k < n:
+                    assert skip.select(k) == skip[k] == values[k]
+            for e in xrange(-1, spread + 1):
+                assert skip.rank(e) == bisect_left(values, e)
+                assert skip.count(e) == values.count(e)
+                assert (e in skip) == (e in values)
+            if n % 2:
+                assert skip.median() == values[n // 2]
+            elif n:
+                assert skip.median() == (values[n // 2 - 1] + values[n // 2]) / 2.0
+            else:
+                try:
+                    skip.median()
+                    assert False
+                except ValueError:
+                    pass
+        while values:
+            e = values.pop(randrange(len(values)))
+            skip.remove(e)
+        checkSkipList(skip)
+        assert skip.level == 1 and len(skip) == 0
+        try:
+            skip.select(0)
+            assert False
+        except IndexError:
+            pass
+    print "    passed"
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        testSkipList()
+        sys.exit(0)
+
+    benchmark(*map(int, sys.argv[1:]))
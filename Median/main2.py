@@ -10,12 +10,16 @@ class rbnode(object):
         self._left = None
         self._right = None
         self._p = None
+        self._next = None
+        self._prev = None
 
     key = property(fget=lambda self: self._key, doc="The node's key")
     red = property(fget=lambda self: self._red, doc="Is the node red?")
     left = property(fget=lambda self: self._left, doc="The node's left child")
     right = property(fget=lambda self: self._right, doc="The node's right child")
     p = property(fget=lambda self: self._p, doc="The node's parent")
+    next = property(fget=lambda self: self._next, doc="The next node in key order")
+    prev = property(fget=lambda self: self._prev, doc="The previous node in key order")
 
     def __str__(self):
         "String representation."
@@ -112,12 +116,21 @@ class rbtree(object):
             else:
                 x = x.right
         z._p = y
+        # the parent is one of z's in-order neighbours
         if y == self.nil:
             self._root = z
         elif z.key < y.key:
             y._left = z
+            z._next = y
+            z._prev = y.prev
         else:
             y._right = z
+            z._prev = y
+            z._next = y.next
+        if z.prev:
+            z.prev._next = z
+        if z.next:
+            z.next._prev = z
         z._left = self.nil
         z._right = self.nil
         z._red = True
@@ -277,7 +290,16 @@ Delete a node from the tree.
         if n.left != self.nil and n.right != self.nil:
             pred = self.maximum(n.left)
             n._key = pred.key
+            # n takes over pred's place in the in-order links
+            n._prev = pred.prev
+            if pred.prev:
+                pred.prev._next = n
             n = pred
+        else:
+            if n.prev:
+                n.prev._next = n.next
+            if n.next:
+                n.next._prev = n.prev
 
         assert n.left == self.nil or n.right == self.nil
 
@@ -417,40 +439,10 @@ rotate right at N's parent.
             return n.p.left
 
     def successor(self, x):
-        #if x has right child, then retrieve the leftmost of its right branch
-        if x.right:
-            return self.minimum(x.right)
-        #if x doesn't have right child and has no parent, then it's root and last node, so no successor
-        if not x.p:
-            return None
-        parent = x.p
-        #otherwise if x is a left child, then parent is its successor
-        if x == parent.left:
-            return parent
-        #otherwise it x is a right child, then it is the last node of its parent's branch, so the successor will be its
-        #parent's successor
-        tmp = parent
-        while tmp.p and tmp != tmp.p.left:
-            tmp = tmp.p
-        return tmp.p
+        return x.next
 
     def predecessor(self, x):
-        #if x has left child, then retrieve the rightmost of its left branch
-        if x.left:
-            return self.maximum(x.left)
-        #if x doesn't have left child and has no parent, then it's root and the first node, so no predecessor
-        if not x.p:
-            return None
-        parent = x.p
-        #otherwise if x is a right child, then parent is its predecessor
-        if x == parent.right:
-            return parent
-        #otherwise it x is a keft child, then it is the first node of its parent's branch, so the predecessor will be its
-        #parent's predecessor
-        tmp = parent
-        while tmp.p and tmp != tmp.p.right:
-            tmp = tmp.p
-        return tmp.p
+        return x.prev
 
 #def write_tree_as_dot(t, f, show_nil=False):
 #    "Write the tree in the dot language format to f."